@@ -1,30 +1,143 @@
 import asyncio
 import logging
-import json
 import argparse
+import signal
+import sys
+import time
+from dataclasses import asdict
 from typing import Optional
 
 from quietcool.client import Client
-from quietcool.api import DataclassJSONEncoder
+from quietcool import codec
+from quietcool.api import Mode, WorkState
+from quietcool.device import NotConnectedError
+from quietcool.mqtt import bridge
+from quietcool.poller import Poller
+from quietcool.pool import pool
+from quietcool.tracing import JsonFileExporter, tracer
 
 logger = logging.getLogger(__name__)
 
-# this allows us to dump dataclasses to json easily
-json.JSONEncoder = DataclassJSONEncoder
 
+def emit(record: dict) -> None:
+    print(codec.dumps(record).decode(), flush=True)
 
-async def main(command: str, api_id: Optional[str] = None) -> None:
-    client = await Client.create(api_id=api_id)
 
-    match command.lower():
-        case "info" | "":
-            info = await client.get_info()
-            print(json.dumps(info, indent=2))
-        case "pair":
-            await client.pair()
-        case _:
+async def watch(client: Client, interval: float) -> None:
+    """
+    Stream newline-delimited JSON over a single connection: static fan
+    information once, then a line for each change in work state.
+
+    Failed polls are logged and retried, except when the link has dropped.
+
+    Raises:
+        NotConnectedError: If the fan disconnects
+    """
+    faninfo = await client.api.get_fan_info()
+    version = await client.api.get_version()
+    emit({"type": "static", "faninfo": faninfo, "version": version})
+
+    last: Optional[WorkState] = None
+
+    async def on_state(state: WorkState) -> None:
+        nonlocal last
+        if state != last:
+            emit({"type": "workstate", "time": time.time(), **asdict(state)})
+            last = state
+
+    poller = Poller(client.api, interval)
+    poller.subscribe(on_state)
+    while True:
+        try:
+            await poller.poll()
+        except NotConnectedError:
+            # polling again won't bring the fan back
+            raise
+        except Exception as e:
+            logger.warning("Polling work state failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+def add_result(result: dict, sections: dict) -> None:
+    """
+    Add *sections* to *result* without overwriting earlier ones: a section
+    that's already there is added again as e.g. workstate_2.
+    """
+    for key, value in sections.items():
+        name, n = key, 2
+        while name in result:
+            name, n = f"{key}_{n}", n + 1
+        result[name] = value
+
+
+def parse_commands(words: list[str]) -> list[tuple[str, list[str]]]:
+    """
+    Split the command line into (command, args) pairs, e.g.
+    ["workstate", "set-mode", "idle"] -> [("workstate", []), ("set-mode", ["idle"])]
+    """
+    commands = []
+    words = [word.lower() for word in words] or ["info"]
+    while words:
+        command = words.pop(0)
+        if command == "set-mode":
+            if not words:
+                raise ValueError("set-mode needs a mode")
+            commands.append((command, [words.pop(0)]))
+        elif command in ("info", "pair", "watch", "mqtt") or command in Client.SECTIONS:
+            commands.append((command, []))
+        else:
             logger.error(f"Unknown command: {command}")
             raise ValueError(f"Unknown command: {command}")
+    return commands
+
+
+async def main(
+    words: list[str],
+    api_id: Optional[str] = None,
+    interval: float = 5.0,
+    dump_packets: bool = False,
+    mqtt_host: str = "localhost",
+    mqtt_port: int = 1883,
+    mqtt_prefix: str = "quietcool",
+) -> None:
+    commands = parse_commands(words)
+    names = [command for command, _ in commands]
+    if {"pair", "watch", "mqtt"} & set(names) and len(commands) > 1:
+        raise ValueError("pair, watch and mqtt can't be combined with other commands")
+
+    packets = None
+    try:
+        async with Client.create(api_id=api_id) as client:
+            packets = client.device.packets
+            if hasattr(signal, "SIGUSR1"):
+                # kill -USR1 dumps recent packets without interrupting anything
+                asyncio.get_running_loop().add_signal_handler(
+                    signal.SIGUSR1, lambda: packets.dump("SIGUSR1", file=sys.stderr)
+                )
+            match commands:
+                case [("pair", _)]:
+                    await client.pair()
+                case [("watch", _)]:
+                    await watch(client, interval)
+                case [("mqtt", _)]:
+                    await bridge([client], mqtt_host, mqtt_port, mqtt_prefix, interval)
+                case _:
+                    # everything else runs over the one connection, into one document
+                    result = {}
+                    for command, args in commands:
+                        if command == "info":
+                            sections = await client.get_info()
+                        elif command == "set-mode":
+                            mode = Mode.parse(args[0])
+                            sections = {command: await client.api.set_mode(mode)}
+                        else:
+                            sections = await client.get_info([command])
+                        add_result(result, sections)
+                    print(codec.dumps_pretty(result))
+    finally:
+        if dump_packets and packets is not None:
+            packets.dump("exit", file=sys.stderr)
+        await pool.close()
 
 
 if __name__ == "__main__":
@@ -33,7 +146,14 @@ if __name__ == "__main__":
         "Connects to a QuietCool Wireless RF Control Kit via BLE\n\n"
         "Commands:\n"
         "  info: Dumps detailed information about the connected fan\n"
-        "  pair: Pairs the client with a fan (fan must be in pairing mode)\n\n"
+        "  pair: Pairs the client with a fan (fan must be in pairing mode)\n"
+        "  watch: Streams work state changes as newline-delimited JSON\n"
+        "  mqtt: Bridges the fan to an MQTT broker (needs quietcool[mqtt])\n\n"
+        "  Sections can be fetched on their own, and combined with each other,\n"
+        "  info and set-mode; they all run over one connection and are output\n"
+        "  as one JSON document:\n"
+        "    faninfo, params, version, presets, workstate, remain-time\n"
+        "    set-mode MODE: Sets the mode (idle, smart or timer)\n\n"
         "API ID:\n"
         "  An API ID is required to connect to the fan. \n"
         "  If no --id is provided, the API ID will be sourced in this order:\n"
@@ -48,11 +168,45 @@ if __name__ == "__main__":
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     parser.add_argument(
-        "command", nargs="?", default="info", help="Command to execute (info or pair)"
+        "command",
+        nargs="*",
+        help="Commands and sections to execute (default: info)",
     )
     parser.add_argument(
         "--id", help="API ID string (see description for details)", default=None
     )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=5.0,
+        help="Seconds between polls for the watch and mqtt commands (default: 5)",
+    )
+    parser.add_argument(
+        "--mqtt-host",
+        default="localhost",
+        help="MQTT broker for the mqtt command (default: localhost)",
+    )
+    parser.add_argument(
+        "--mqtt-port",
+        type=int,
+        default=1883,
+        help="MQTT broker port (default: 1883)",
+    )
+    parser.add_argument(
+        "--mqtt-prefix",
+        default="quietcool",
+        help="Prefix for the mqtt command's topics (default: quietcool)",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Append timing spans for each operation to PATH as JSON lines",
+    )
+    parser.add_argument(
+        "--dump-packets",
+        action="store_true",
+        help="Print the most recent BLE packets to stderr on exit",
+    )
     parser.add_argument(
         "--log-level",
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
@@ -67,4 +221,21 @@ if __name__ == "__main__":
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     )
 
-    asyncio.run(main(args.command, args.id))
+    if args.trace:
+        tracer.add_exporter(JsonFileExporter(args.trace))
+
+    try:
+        asyncio.run(
+            main(
+                args.command,
+                args.id,
+                args.interval,
+                args.dump_packets,
+                args.mqtt_host,
+                args.mqtt_port,
+                args.mqtt_prefix,
+            )
+        )
+    except NotConnectedError as e:
+        logger.error("Lost the connection to the fan: %s", e)
+        sys.exit(1)
@@ -4,3 +4,15 @@ import logging
 
 # Configure module-level logger
 logger = logging.getLogger(__name__)
+
+
+def cache_dir():
+    """
+    Directory for quietcool's on-disk caches: $XDG_CACHE_HOME/quietcool, or
+    ~/.cache/quietcool.
+    """
+    import os
+    import pathlib
+
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "quietcool"
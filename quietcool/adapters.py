@@ -0,0 +1,282 @@
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Iterable, Optional
+import asyncio
+
+from bleak import BleakScanner
+from bleak.backends.device import BLEDevice
+
+from .device import Device, NotConnectedError
+from . import logger
+
+# scans on one adapter, returning each fan heard and its RSSI, by address
+AdapterScan = Callable[[str], Awaitable[dict[str, tuple[BLEDevice, int]]]]
+
+
+async def bleak_scan(
+    adapter: str, timeout: float = 5.0
+) -> dict[str, tuple[BLEDevice, int]]:
+    found = await BleakScanner.discover(
+        timeout=timeout, return_adv=True, bluez={"adapter": adapter}
+    )
+    return {
+        device.address: (device, adv.rssi)
+        for device, adv in found.values()
+        if device.name and device.name.startswith("ATTICFAN")
+    }
+
+
+@dataclass
+class Adapter:
+    """
+    One Bluetooth HCI adapter and the fans connected through it.
+
+    Attributes:
+        name: The adapter's name, e.g. "hci0"
+        links: Addresses of fans connected through this adapter
+        failures: Connection attempts that failed on this adapter
+    """
+
+    name: str
+    links: set[str] = field(default_factory=set)
+    failures: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+
+class AdapterScheduler:
+    """
+    Places fan connections across several Bluetooth adapters.
+
+    Every adapter is scanned to find out which fans it can hear, and how well.
+    Each fan is then connected through the adapter with the best score: its
+    RSSI there, less *link_penalty* dB for every link the adapter already
+    carries, so load spreads out unless one adapter is much closer. If
+    connecting fails, or a link drops, the fan is moved to the next best
+    adapter, reconnecting the same Device so anything holding it carries on.
+
+    Connection attempts are serialized per adapter, since most controllers
+    can only make one at a time, but run in parallel across adapters.
+
+    Pass one to ConnectionPool to have Client.create place its connections:
+
+        pool = ConnectionPool(adapters=AdapterScheduler(["hci0", "hci1"]))
+        client = await Client.create(address=address, pool=pool)
+
+    Attributes:
+        adapters: The Adapters, by name
+        rssi: RSSI of each fan on each adapter that heard it, by fan address
+        found: The BLEDevice each adapter's scan found for each fan, by fan
+            address; connecting through these saves bleak a scan of its own
+        devices: Connected Devices, by fan address
+        max_links: Most connections to hold through one adapter
+        link_penalty: dB taken off an adapter's score per existing link
+    """
+
+    def __init__(
+        self,
+        adapters: Iterable[str],
+        scan: AdapterScan = bleak_scan,
+        max_links: int = 7,
+        link_penalty: float = 6.0,
+        client_class: Optional[type] = None,
+    ) -> None:
+        self.adapters = {name: Adapter(name) for name in adapters}
+        self.scan = scan
+        self.max_links = max_links
+        self.link_penalty = link_penalty
+        self.client_class = client_class
+        self.rssi: dict[str, dict[str, int]] = {}
+        self.found: dict[str, dict[str, BLEDevice]] = {}
+        self.devices: dict[str, Device] = {}
+        # reconnections under way, by fan address
+        self._recovering: dict[str, asyncio.Task] = {}
+
+    async def survey(self) -> dict[str, dict[str, int]]:
+        """
+        Scan on every adapter at once and record which fans each one hears.
+        """
+        names = list(self.adapters)
+        results = await asyncio.gather(
+            *(self.scan(name) for name in names), return_exceptions=True
+        )
+        self.rssi, self.found = {}, {}
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.warning("Scanning on %s failed: %s", name, result)
+                continue
+            for address, (fan, rssi) in result.items():
+                self.rssi.setdefault(address, {})[name] = rssi
+                self.found.setdefault(address, {})[name] = fan
+        return self.rssi
+
+    def rank(self, address: str, avoid: Iterable[str] = ()) -> list[Adapter]:
+        """
+        The adapters that can take a link to the fan at *address*, best first.
+        Adapters in *avoid* are put last rather than left out.
+        """
+        avoid = set(avoid)
+        heard = self.rssi.get(address, {})
+        candidates = [
+            self.adapters[name]
+            for name in heard
+            if len(self.adapters[name].links) < self.max_links
+        ]
+        return sorted(
+            candidates,
+            key=lambda a: (
+                a.name in avoid,
+                -(heard[a.name] - self.link_penalty * len(a.links)),
+                len(a.links),
+                a.failures,
+            ),
+        )
+
+    async def place(self, device: Device, avoid: Iterable[str] = ()) -> Device:
+        """
+        (Re)connect *device* through the best adapter that works, leaving
+        device.adapter set to it.
+
+        Raises:
+            NotConnectedError: If no adapter can hear the fan or connect to it
+        """
+        address = device.address
+        for adapter in self.rank(address, avoid):
+            async with adapter.lock:
+                if len(adapter.links) >= self.max_links:
+                    continue
+                device.adapter = adapter.name
+                try:
+                    await device.reconnect(self.found[address][adapter.name])
+                except Exception as e:
+                    adapter.failures += 1
+                    logger.info(
+                        "Connecting %s via %s failed: %s", address, adapter.name, e
+                    )
+                    continue
+                adapter.links.add(address)
+                self.devices[address] = device
+                if self._on_disconnect not in device.disconnect_listeners:
+                    device.disconnect_listeners.append(self._on_disconnect)
+                logger.info("Connected %s via %s", address, adapter.name)
+                return device
+        device.adapter = None
+        raise NotConnectedError(f"No adapter could connect to {address}")
+
+    async def connect(
+        self, address: Optional[str] = None, avoid: Iterable[str] = ()
+    ) -> Device:
+        """
+        Connect to the fan at *address*, or if None the strongest fan that
+        isn't connected yet, surveying first if it hasn't been heard.
+
+        Raises:
+            NotConnectedError: If no adapter can hear the fan or connect to it
+        """
+        if address is None or address not in self.rssi:
+            await self.survey()
+        if address is None:
+            free = [a for a in self.rssi if a not in self.devices]
+            if not free:
+                raise NotConnectedError("No unconnected fan found")
+            address = max(free, key=lambda a: max(self.rssi[a].values()))
+        elif address not in self.rssi:
+            raise NotConnectedError(f"No adapter can hear {address}")
+        fan = next(iter(self.found[address].values()))
+        device = Device(fan)
+        if self.client_class is not None:
+            device.client_class = self.client_class
+        return await self.place(device, avoid)
+
+    async def connect_all(
+        self, addresses: Optional[Iterable[str]] = None
+    ) -> dict[str, Device]:
+        """
+        Connect to every fan surveyed (or just *addresses*), placing the fans
+        heard by the fewest adapters first since they have the least choice.
+        Fans that can't be connected are logged and left out.
+        """
+        if not self.rssi:
+            await self.survey()
+        if addresses is None:
+            addresses = self.rssi
+        todo = sorted(addresses, key=lambda address: len(self.rssi.get(address, ())))
+        results = await asyncio.gather(
+            *(self.connect(address) for address in todo), return_exceptions=True
+        )
+        for address, result in zip(todo, results):
+            if isinstance(result, Exception):
+                logger.warning("Couldn't connect %s: %s", address, result)
+        return dict(self.devices)
+
+    def release(self, device: Device) -> None:
+        """
+        Forget a device's placement, e.g. once it has been disconnected.
+        """
+        address = device.address
+        if self.devices.get(address) is device:
+            del self.devices[address]
+        if device.adapter in self.adapters:
+            self.adapters[device.adapter].links.discard(address)
+
+    def _on_disconnect(self, device: Device) -> None:
+        if self.devices.get(device.address) is device:
+            logger.info("Lost %s via %s, moving it", device.address, device.adapter)
+            self.recover(device)
+
+    def recover(self, device: Device) -> asyncio.Task:
+        """
+        Move *device* to the next best adapter after its link has dropped,
+        trying the one it dropped from last. The same Device is reconnected,
+        so Clients using it keep working (Api logs in again on its next
+        command). This runs by itself whenever a placed device's link drops;
+        callers that need the device back can await the returned task, which
+        is shared by everyone recovering the same fan.
+
+        The task raises NotConnectedError if no adapter could reconnect the
+        fan, which is then forgotten.
+        """
+        address = device.address
+        task = self._recovering.get(address)
+        if task is None:
+            task = asyncio.create_task(self._recover(device))
+            self._recovering[address] = task
+            task.add_done_callback(self._recovered)
+        return task
+
+    async def _recover(self, device: Device) -> Device:
+        if device.connected:
+            return device
+        dropped = device.adapter
+        if dropped in self.adapters:
+            self.adapters[dropped].links.discard(device.address)
+            self.adapters[dropped].failures += 1
+        try:
+            return await self.place(device, avoid=[dropped] if dropped else [])
+        except NotConnectedError:
+            self.release(device)
+            raise
+
+    def _recovered(self, task: asyncio.Task) -> None:
+        for address, recovering in list(self._recovering.items()):
+            if recovering is task:
+                del self._recovering[address]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("%s", task.exception())
+
+    async def maintain(self) -> list[str]:
+        """
+        Recover every fan whose link has dropped (see recover) and wait for
+        them. Dropped links are recovered automatically, so this is only
+        needed to wait for that, or to catch drops the backend didn't report.
+
+        Returns:
+            Addresses of fans that couldn't be reconnected
+        """
+        lost = [d for d in self.devices.values() if not d.connected]
+        results = await asyncio.gather(
+            *(self.recover(device) for device in lost), return_exceptions=True
+        )
+        return [
+            device.address
+            for device, result in zip(lost, results)
+            if isinstance(result, NotConnectedError)
+        ]
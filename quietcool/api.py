@@ -1,8 +1,12 @@
+from .capabilities import Capabilities, CapabilityCache, UnsupportedCommandError
+from .debounce import Debouncer
 from .device import Device
+from .tracing import traced
 from . import logger
 from dataclasses import dataclass, asdict
-from typing import Self, TypeAlias
+from typing import Awaitable, Callable, Iterable, Optional, Self, TypeAlias
 from enum import Enum
+import asyncio
 import json
 
 
@@ -324,6 +328,19 @@ class Mode(str, Enum):
     """Fan operating mode options."""
 
     IDLE = "Idle"
+    SMART = "TH"
+    TIMER = "Timer"
+
+    @classmethod
+    def parse(cls, name: str) -> Self:
+        """
+        Look up a mode by name or wire value, ignoring case, e.g. "smart" or
+        "TH".
+        """
+        for mode in cls:
+            if name.lower() in (mode.name.lower(), mode.value.lower()):
+                return mode
+        raise ValueError(f"Unknown mode: {name}")
 
 
 class HumidityRange(str, Enum):
@@ -333,6 +350,9 @@ class HumidityRange(str, Enum):
     LOW = "LOW"
 
 
+ModeListener: TypeAlias = Callable[[Mode], Awaitable[None]]
+
+
 class Api:
     """
     API client for interacting with the fan device.
@@ -343,14 +363,167 @@ class Api:
     Attributes:
         device: The fan device instance
         pair_id: The pairing ID for authentication
-        logged_in: Whether the client is currently logged in
+        logged_in: Whether the client is logged in on the device's current
+                   connection
+        debouncer: If set, rapid successive commands of the same kind in
+                   *debounced* are coalesced and only the last one is sent
+                   (see Debouncer)
+        debounced: The commands the debouncer applies to
     """
 
-    def __init__(self, device: Device, pair_id: str) -> None:
+    # read-only commands that are safe to send just to see if they work, and
+    # the class each response is parsed into. GetUpgradeState isn't here: it
+    # only answers properly mid-upgrade, and marking it unsupported would
+    # abort upgrade_firmware part way through.
+    PROBES = {
+        "GetParameter": Parameters,
+        "GetPresets": None,
+        "GetRemainTime": RemainTime,
+        "GetWorkState": WorkState,
+    }
+
+    # settings that are typically dragged through a range of values, where
+    # only the last one matters; mode changes are never debounced
+    DEBOUNCED = frozenset({"SetTempHumidity", "SetTime"})
+
+    def __init__(
+        self,
+        device: Device,
+        pair_id: str,
+        debounce: float = 0.0,
+        debounced: Iterable[str] = DEBOUNCED,
+    ) -> None:
         self.device = device
         self.pair_id = pair_id
-        self.logged_in = False
+        # Device.connections when we last logged in; logins don't survive a
+        # reconnect
+        self._login_connection: Optional[int] = None
+        self.debouncer = Debouncer(debounce) if debounce > 0 else None
+        self.debounced = frozenset(debounced)
+        # Get commands in flight: the task and how many callers are waiting on
+        # it; a lost response ends with Device.response_timeout
+        self._inflight: dict[tuple, list] = {}
+        # called with the fan's new mode after each set_mode it accepts, in
+        # tasks of their own so set_mode doesn't wait for them
+        self.mode_listeners: list[ModeListener] = []
+        self._listener_tasks: set[asyncio.Task] = set()
+
+    @property
+    def logged_in(self) -> bool:
+        return (
+            self.device.connected and self._login_connection == self.device.connections
+        )
 
+    @logged_in.setter
+    def logged_in(self, value: bool) -> None:
+        self._login_connection = self.device.connections if value else None
+
+    async def _send(self, **kwargs) -> dict:
+        capabilities = self.device.capabilities
+        if capabilities is not None and not capabilities.supports(kwargs["Api"]):
+            raise UnsupportedCommandError(
+                f"{kwargs['Api']} is not supported by firmware {capabilities.version}"
+            )
+        if kwargs["Api"] in self.debounced and self.debouncer is not None:
+            return await self.debouncer.submit(
+                kwargs["Api"], lambda: self.device.send_command(**kwargs)
+            )
+        if not kwargs["Api"].startswith("Get"):
+            return await self.device.send_command(**kwargs)
+
+        # single-flight: identical reads made while one is in flight share it
+        key = tuple(sorted(kwargs.items()))
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            task = asyncio.ensure_future(self.device.send_command(**kwargs))
+            inflight = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._forget_inflight(key, inflight))
+        else:
+            logger.debug("Joining in-flight %s", kwargs["Api"])
+        inflight[1] += 1
+        try:
+            return await asyncio.shield(inflight[0])
+        except asyncio.CancelledError:
+            # only cancel the read itself once nobody is waiting for it
+            inflight[1] -= 1
+            if inflight[1] == 0:
+                self._forget_inflight(key, inflight)
+                inflight[0].cancel()
+            raise
+
+    def _forget_inflight(self, key: tuple, inflight: list) -> None:
+        if self._inflight.get(key) is inflight:
+            del self._inflight[key]
+
+    @traced("api.probe_capabilities")
+    async def probe_capabilities(
+        self, cache: Optional[CapabilityCache] = None, timeout: float = 5.0
+    ) -> Capabilities:
+        """
+        Find out which commands the fan's firmware supports, so that
+        unsupported ones fail instantly instead of timing out.
+
+        The result is looked up in (and saved to) *cache* by serial number and
+        firmware version, so each fan is only probed once per firmware.
+        Commands whose response is missing fields are marked unsupported.
+        Commands that don't answer within *timeout* seconds aren't marked
+        either way, since a lost response proves nothing, and are probed again
+        next time. Once probed, the capabilities are kept on the Device and
+        shared by every Api using it.
+
+        Args:
+            cache: Where to persist results; defaults to CapabilityCache()
+            timeout: Seconds to wait for each probed command
+
+        Returns:
+            The fan's Capabilities
+        """
+        if self.device.capabilities is not None:
+            return self.device.capabilities
+        if cache is None:
+            cache = CapabilityCache()
+
+        fan_info = await self.get_fan_info()
+        version = await self.get_version()
+        capabilities = cache.get(fan_info.serial_num, version.version)
+        if capabilities is not None:
+            # only trust results for commands that are still probed
+            capabilities.commands = {
+                command: supported
+                for command, supported in capabilities.commands.items()
+                if command in self.PROBES
+            }
+        else:
+            capabilities = Capabilities(
+                fan_info.serial_num, version.version, version.hw_version
+            )
+
+        unprobed = [c for c in self.PROBES if c not in capabilities.commands]
+        for command in unprobed:
+            try:
+                response = await asyncio.wait_for(
+                    self.device.send_command(Api=command), timeout
+                )
+            except asyncio.TimeoutError:
+                logger.info("%s timed out, will probe it again next time", command)
+                continue
+            try:
+                if self.PROBES[command] is not None:
+                    self.PROBES[command].from_response(response)
+                supported = True
+            except (KeyError, TypeError) as e:
+                logger.info("%s response is missing %s", command, e)
+                supported = False
+            capabilities.commands[command] = supported
+            capabilities.fields[command] = sorted(response)
+        if unprobed:
+            cache.put(capabilities)
+            logger.info("Probed capabilities: %s", capabilities)
+
+        self.device.capabilities = capabilities
+        return capabilities
+
+    @traced("api.login")
     async def login(self) -> None:
         """
         Login to the fan device.
@@ -361,7 +534,7 @@ class Api:
         Raises:
             LoginError: If the login fails
         """
-        response = await self.device.send_command(Api="Login", PhoneID=self.pair_id)
+        response = await self._send(Api="Login", PhoneID=self.pair_id)
 
         if response["Result"] == "Success":
             self.logged_in = True
@@ -369,6 +542,7 @@ class Api:
         else:
             raise LoginError(f"Login failed: {response}")
 
+    @traced("api.send_login")
     async def send_login(self) -> dict:
         """
         Send a login command to the fan device.
@@ -379,8 +553,9 @@ class Api:
                 - Result: "Success" or "Fail"
                 - PairState: "No" or "Yes" indicating if device is in pairing mode
         """
-        return await self.device.send_command(Api="Login", PhoneID=self.pair_id)
+        return await self._send(Api="Login", PhoneID=self.pair_id)
 
+    @traced("api.ensure_logged_in")
     async def ensure_logged_in(self) -> None:
         """
         Ensure the client is logged in.
@@ -394,6 +569,7 @@ class Api:
         if not self.logged_in:
             await self.login()
 
+    @traced("api.get_fan_info")
     async def get_fan_info(self) -> FanInfo:
         """
         Retrieve information about the fan.
@@ -403,11 +579,12 @@ class Api:
         """
         await self.ensure_logged_in()
 
-        response = await self.device.send_command(Api="GetFanInfo")
+        response = await self._send(Api="GetFanInfo")
         fan_info = FanInfo.from_response(response)
         logger.debug("Fan info: %s", fan_info)
         return fan_info
 
+    @traced("api.get_parameters")
     async def get_parameters(self) -> Parameters:
         """
         Retrieve current fan parameters.
@@ -417,11 +594,12 @@ class Api:
         """
         await self.ensure_logged_in()
 
-        response = await self.device.send_command(Api="GetParameter")
+        response = await self._send(Api="GetParameter")
         parameter_info = Parameters.from_response(response)
         logger.debug("Parameter: %s", parameter_info)
         return parameter_info
 
+    @traced("api.get_presets")
     async def get_presets(self) -> PresetList:
         """
         Retrieve list of fan presets.
@@ -432,11 +610,12 @@ class Api:
         await self.ensure_logged_in()
 
         # TODO: the android app passes "FanType":"THREE" here
-        response = await self.device.send_command(Api="GetPresets")
+        response = await self._send(Api="GetPresets")
         presets = [Preset.from_response(preset) for preset in response["Presets"]]
         logger.debug("Presets: %s", presets)
         return presets
 
+    @traced("api.get_remain_time")
     async def get_remain_time(self) -> RemainTime:
         """
         Retrieve remaining time information.
@@ -448,11 +627,12 @@ class Api:
         """
         await self.ensure_logged_in()
 
-        response = await self.device.send_command(Api="GetRemainTime")
+        response = await self._send(Api="GetRemainTime")
         remain_time = RemainTime.from_response(response)
         logger.debug("Remain time: %s", remain_time)
         return remain_time
 
+    @traced("api.get_upgrade_state")
     async def get_upgrade_state(self) -> UpgradeState:
         """
         Retrieve the current upgrade state.
@@ -464,11 +644,12 @@ class Api:
         """
         await self.ensure_logged_in()
 
-        response = await self.device.send_command(Api="GetUpgradeState")
+        response = await self._send(Api="GetUpgradeState")
         upgrade_state = UpgradeState.from_response(response)
         logger.debug("Upgrade state: %s", upgrade_state)
         return upgrade_state
 
+    @traced("api.get_version")
     async def get_version(self) -> VersionInfo:
         """
         Retrieve version information.
@@ -478,11 +659,12 @@ class Api:
         """
         await self.ensure_logged_in()
 
-        response = await self.device.send_command(Api="GetVersion")
+        response = await self._send(Api="GetVersion")
         version_info = VersionInfo.from_response(response)
         logger.debug("Version info: %s", version_info)
         return version_info
 
+    @traced("api.get_work_state")
     async def get_work_state(self) -> WorkState:
         """
         Retrieve current working state.
@@ -492,11 +674,12 @@ class Api:
         """
         await self.ensure_logged_in()
 
-        response = await self.device.send_command(Api="GetWorkState")
+        response = await self._send(Api="GetWorkState")
         work_state = WorkState.from_response(response)
         logger.debug("Work state: %s", work_state)
         return work_state
 
+    @traced("api.pair")
     async def pair(self, pair_id: str) -> bool:
         """
         Add a new pairing ID to the fan. Fan must be in pairing mode already.
@@ -507,9 +690,10 @@ class Api:
         Returns:
             bool: True if pairing was successful, False otherwise
         """
-        response = await self.device.send_command(Api="Pair", PhoneID=pair_id)
+        response = await self._send(Api="Pair", PhoneID=pair_id)
         return response.get("Result") == "Success"
 
+    @traced("api.pair_mode")
     async def pair_mode(self) -> PairModeResponse:
         """
         Tell the fan to enter pairing mode.
@@ -518,9 +702,10 @@ class Api:
             PairModeResponse containing the result
         """
         await self.ensure_logged_in()
-        response = await self.device.send_command(Api="PairMode")
+        response = await self._send(Api="PairMode")
         return PairModeResponse.from_response(response)
 
+    @traced("api.reset")
     async def reset(self) -> ResetResponse:
         """
         Reset the fan. (???)
@@ -531,9 +716,10 @@ class Api:
             ResetResponse containing the result
         """
         await self.ensure_logged_in()
-        response = await self.device.send_command(Api="Reset")
+        response = await self._send(Api="Reset")
         return ResetResponse.from_response(response)
 
+    @traced("api.set_fan_info")
     async def set_fan_info(
         self, name: str, model: str, serial_num: str
     ) -> SetFanInfoResponse:
@@ -549,11 +735,12 @@ class Api:
             SetFanInfoResponse containing the result
         """
         await self.ensure_logged_in()
-        response = await self.device.send_command(
+        response = await self._send(
             Api="SetFanInfo", Name=name, Model=model, SerialNum=serial_num
         )
         return SetFanInfoResponse.from_response(response)
 
+    @traced("api.set_guide_setup")
     async def set_guide_setup(self, guide_setup: GuideSetup) -> SetGuideSetupResponse:
         """
         Set the guide setup state.
@@ -565,13 +752,12 @@ class Api:
             SetGuideSetupResponse containing the result
         """
         await self.ensure_logged_in()
-        response = await self.device.send_command(
-            Api="SetGuideSetup", GuideSetup=guide_setup
-        )
+        response = await self._send(Api="SetGuideSetup", GuideSetup=guide_setup)
         return SetGuideSetupResponse.from_response(response)
 
     # TODO: the android app passes "Mode":"TH" here
     # it gets a response like: {"Api": "SetMode", "WorkMode": "TH", "Flag": "TRUE"}
+    @traced("api.set_mode")
     async def set_mode(self, mode: Mode) -> SetModeResponse:
         """
         Set the fan's operating mode.
@@ -583,15 +769,33 @@ class Api:
             SetModeResponse containing the result
         """
         await self.ensure_logged_in()
-        response = await self.device.send_command(Api="SetMode", Mode=mode)
+        response = await self._send(Api="SetMode", Mode=mode)
         # TODO: check that Flag is TRUE
+        if response.get("Flag") == "TRUE":
+            # tell listeners what the fan says it's now in, not what was asked
+            try:
+                work_mode = Mode(response.get("WorkMode", mode))
+            except ValueError:
+                logger.warning("Unknown WorkMode in %s", response)
+            else:
+                for listener in list(self.mode_listeners):
+                    task = asyncio.create_task(listener(work_mode))
+                    self._listener_tasks.add(task)
+                    task.add_done_callback(self._listener_done)
         return SetModeResponse.from_response(response)
 
+    def _listener_done(self, task: asyncio.Task) -> None:
+        self._listener_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Mode listener failed", exc_info=task.exception())
+
+    @traced("api.set_presets")
     async def set_presets(self) -> SetPresetsResponse:
         await self.ensure_logged_in()
-        response = await self.device.send_command(Api="SetPresets")
+        response = await self._send(Api="SetPresets")
         return SetPresetsResponse.from_response(response)
 
+    @traced("api.set_router")
     async def set_router(self, ssid: str, password: str) -> SetRouterResponse:
         """
         Set the WiFi router credentials. (???)
@@ -604,11 +808,10 @@ class Api:
             SetRouterResponse containing the result
         """
         await self.ensure_logged_in()
-        response = await self.device.send_command(
-            Api="SetRouter", Ssid=ssid, Password=password
-        )
+        response = await self._send(Api="SetRouter", Ssid=ssid, Password=password)
         return SetRouterResponse.from_response(response)
 
+    @traced("api.set_temp_humidity")
     async def set_temp_humidity(
         self,
         temp_high: int,
@@ -633,7 +836,7 @@ class Api:
             SetTempHumidityResponse containing the result
         """
         await self.ensure_logged_in()
-        response = await self.device.send_command(
+        response = await self._send(
             Api="SetTempHumidity",
             SetTemp_H=temp_high,
             SetTemp_M=temp_medium,
@@ -644,6 +847,7 @@ class Api:
         )
         return SetTempHumidityResponse.from_response(response)
 
+    @traced("api.set_time")
     async def set_time(
         self, hour: int, minute: int, time_range: str
     ) -> SetTimeResponse:
@@ -659,11 +863,12 @@ class Api:
             SetTimeResponse containing the result
         """
         await self.ensure_logged_in()
-        response = await self.device.send_command(
+        response = await self._send(
             Api="SetTime", SetHour=hour, SetMinute=minute, SetTime_Range=time_range
         )
         return SetTimeResponse.from_response(response)
 
+    @traced("api.upgrade")
     async def upgrade(self, url: str) -> UpgradeResponse:
         """
         Initiate a firmware upgrade from the specified URL.
@@ -675,5 +880,5 @@ class Api:
             UpgradeResponse containing the result
         """
         await self.ensure_logged_in()
-        response = await self.device.send_command(Api="Upgrade", URL=url)
+        response = await self._send(Api="Upgrade", URL=url)
         return UpgradeResponse.from_response(response)
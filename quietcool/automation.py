@@ -0,0 +1,156 @@
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+import time
+
+from .api import Api, Mode, WorkState
+from .poller import Poller
+from . import logger
+
+
+@dataclass
+class Rule:
+    """
+    A threshold rule on the fan's temperature or humidity.
+
+    The rule switches on when the reading crosses *on_at* and switches off
+    again only once it crosses back past *off_at*; the gap between the two is
+    the hysteresis band. If on_at is above off_at the rule fires on rising
+    readings (e.g. "run the fan when it's hot"), otherwise on falling ones.
+
+    Attributes:
+        name: Name used in logs
+        metric: "temperature" or "humidity"
+        on_at: Reading at which the rule switches on
+        off_at: Reading at which the rule switches off
+        on_mode: Mode to set when the rule switches on
+        off_mode: Mode to set when the rule switches off
+        min_dwell: Minimum seconds to stay on or off before switching again
+        active: Whether the rule is currently on
+        changed_at: Monotonic time of the last switch
+    """
+
+    name: str
+    metric: str
+    on_at: float
+    off_at: float
+    on_mode: Mode = Mode.SMART
+    off_mode: Mode = Mode.IDLE
+    min_dwell: float = 300.0
+    active: bool = False
+    changed_at: Optional[float] = field(default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.metric not in ("temperature", "humidity"):
+            raise ValueError(f"Unknown metric: {self.metric}")
+
+    def wants(self, value: float) -> bool:
+        """
+        Returns whether the rule should be on given *value*, applying
+        hysteresis but not dwell time.
+        """
+        rising = self.on_at > self.off_at
+        if self.active:
+            return value > self.off_at if rising else value < self.off_at
+        return value >= self.on_at if rising else value <= self.on_at
+
+    def evaluate(self, state: WorkState, now: float) -> Optional[Mode]:
+        """
+        Update the rule from a new reading.
+
+        Returns:
+            The mode to switch to if the rule changed state, otherwise None
+        """
+        wanted = self.wants(getattr(state, self.metric))
+        if wanted == self.active:
+            return None
+        if self.changed_at is not None and now - self.changed_at < self.min_dwell:
+            return None
+        self.active = wanted
+        self.changed_at = now
+        return self.on_mode if wanted else self.off_mode
+
+
+class AutomationEngine:
+    """
+    Runs rules in-process against a shared Poller.
+
+    Every rule is evaluated against the same WorkState reading. When any rule
+    switches, the fan is set to the on_mode of the last rule that is on, or
+    if none are, to the off_mode of the rule that switched off, so one rule
+    switching off doesn't stop the fan while another still wants it on. Mode
+    changes are rate limited across the whole engine so that rules can't
+    fight each other into flapping the fan, and a mode change that fails, or
+    that the fan refuses, is retried on the next reading.
+
+    Attributes:
+        api: The Api used to change modes
+        poller: The Poller that feeds readings to the rules
+        rules: The rules, evaluated in order
+        min_action_interval: Minimum seconds between mode changes
+        pending: A mode change waiting on the rate limit or a retry
+    """
+
+    def __init__(
+        self,
+        api: Api,
+        rules: Iterable[Rule],
+        poller: Optional[Poller] = None,
+        min_action_interval: float = 60.0,
+    ) -> None:
+        self.api = api
+        self.rules = list(rules)
+        self.poller = poller if poller is not None else Poller(api)
+        self.min_action_interval = min_action_interval
+        self.last_action: Optional[float] = None
+        self.pending: Optional[Mode] = None
+        self.poller.subscribe(self.on_state)
+
+    async def on_state(self, state: WorkState) -> None:
+        now = time.monotonic()
+        switched_off: Optional[Rule] = None
+        changed = False
+        for rule in self.rules:
+            if rule.evaluate(state, now) is not None:
+                logger.info(
+                    "Rule %s is now %s", rule.name, "on" if rule.active else "off"
+                )
+                changed = True
+                if not rule.active:
+                    switched_off = rule
+        if changed:
+            active = [rule for rule in self.rules if rule.active]
+            self.pending = active[-1].on_mode if active else switched_off.off_mode
+
+        if self.pending is None:
+            return
+        if state.mode == self.pending:
+            self.pending = None
+            return
+        if (
+            self.last_action is not None
+            and now - self.last_action < self.min_action_interval
+        ):
+            # keep it pending and try again on a later reading
+            logger.debug("Rate limited: not setting mode %s yet", self.pending.value)
+            return
+
+        logger.info("Setting mode %s", self.pending.value)
+        mode = self.pending
+        try:
+            result = await self.api.set_mode(mode)
+        except Exception as e:
+            # leave it pending, to try again on the next reading
+            logger.warning("Setting mode %s failed: %s", mode.value, e)
+            return
+        if result.response.get("Flag") != "TRUE":
+            logger.warning("Fan refused mode %s: %s", mode.value, result.response)
+            return
+        self.last_action = now
+        if self.pending is mode:
+            self.pending = None
+
+    async def run(self) -> None:
+        """
+        Start the poller (if it isn't already running) and wait on it forever.
+        """
+        await self.poller.start()
@@ -0,0 +1,95 @@
+from dataclasses import asdict, dataclass, field, fields
+from typing import Optional
+import json
+import pathlib
+
+from . import cache_dir, logger
+
+
+class UnsupportedCommandError(Exception):
+    """Raised instead of sending a command the fan's firmware doesn't support."""
+
+
+@dataclass
+class Capabilities:
+    """
+    What a fan's firmware is known to support, as found by probing it.
+
+    Attributes:
+        serial_num: The fan's serial number
+        version: The fan's firmware version
+        hw_version: The fan's hardware version
+        commands: Whether each probed command is supported, by Api name;
+            commands that didn't answer when probed are left out
+        fields: The response fields each probed command returned, by Api name,
+            for checking whether the firmware reports an optional field
+    """
+
+    serial_num: str
+    version: str
+    hw_version: str
+    commands: dict[str, bool] = field(default_factory=dict)
+    fields: dict[str, list[str]] = field(default_factory=dict)
+
+    @property
+    def key(self) -> str:
+        return f"{self.serial_num}/{self.version}"
+
+    def supports(self, command: str) -> bool:
+        """
+        Whether *command* is supported. Commands that weren't probed are
+        assumed to be.
+        """
+        return self.commands.get(command, True)
+
+    def has_field(self, command: str, name: str) -> bool:
+        """
+        Whether *command*'s response included *name* when it was probed.
+        """
+        return name in self.fields.get(command, ())
+
+
+class CapabilityCache:
+    """
+    Capabilities persisted to a JSON file, keyed by serial number and firmware
+    version so that a firmware upgrade triggers a fresh probe.
+
+    Attributes:
+        path: The JSON file; defaults to capabilities.json in cache_dir()
+    """
+
+    def __init__(self, path: Optional[pathlib.Path] = None) -> None:
+        self.path = path if path is not None else cache_dir() / "capabilities.json"
+        self._entries: Optional[dict[str, dict]] = None
+
+    def _load(self) -> dict[str, dict]:
+        if self._entries is None:
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except FileNotFoundError:
+                self._entries = {}
+            except (OSError, ValueError) as e:
+                logger.warning(
+                    "Ignoring unreadable capability cache %s: %s", self.path, e
+                )
+                self._entries = {}
+        return self._entries
+
+    def get(self, serial_num: str, version: str) -> Optional[Capabilities]:
+        entry = self._load().get(f"{serial_num}/{version}")
+        if entry is None:
+            return None
+        # skip anything this version of Capabilities doesn't have
+        names = {f.name for f in fields(Capabilities)}
+        return Capabilities(**{k: v for k, v in entry.items() if k in names})
+
+    def put(self, capabilities: Capabilities) -> None:
+        entries = self._load()
+        entries[capabilities.key] = asdict(capabilities)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(entries, indent=2))
+            tmp.replace(self.path)
+        except OSError as e:
+            logger.warning("Couldn't save capability cache %s: %s", self.path, e)
@@ -1,12 +1,85 @@
-from typing import Optional, Self
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Coroutine, Iterable, Iterator, Optional, Self
+import asyncio
 import os
 import pathlib
+import random
+import time
+
+from bleak.exc import BleakError
 
 from .api import Api
-from .device import Device
+from .device import Device, NotConnectedError
+from .pool import ConnectionPool, pool as shared_pool
+from .tracing import traced
 from . import logger
 
 
+# These are guesses: GetUpgradeState has only ever been seen mid-upgrade.
+UPGRADE_DONE_STATES = frozenset({"Success", "Finish", "Done"})
+UPGRADE_FAILED_STATES = frozenset({"Fail", "Failed", "Error"})
+
+
+class UpgradeError(Exception):
+    """Raised when a firmware upgrade fails or times out."""
+
+
+@dataclass
+class UpgradeProgress:
+    """
+    A progress event from a firmware upgrade.
+
+    Attributes:
+        address: BLE address of the fan being upgraded
+        stage: One of "upgrade", "router", "poll", "reconnect", "done", "failed"
+        state: Last state reported by GetUpgradeState, if any
+        attempt: Poll or reconnect attempt number within the stage
+        elapsed: Seconds since the upgrade started
+        error: Description of the failure, for "reconnect" and "failed" events
+    """
+
+    address: str
+    stage: str
+    state: Optional[str] = None
+    attempt: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+
+def backoff_delays(
+    initial: float = 1.0, maximum: float = 30.0, factor: float = 2.0
+) -> Iterator[float]:
+    """
+    Yields exponentially increasing delays, capped at *maximum*, with jitter so
+    that many fans being polled at once don't end up in lockstep.
+    """
+    delay = initial
+    while True:
+        yield random.uniform(delay / 2, delay)
+        delay = min(delay * factor, maximum)
+
+
+class _Creating:
+    """
+    What Client.create returns: await it for a Client, or use it with
+    `async with` to have the Client closed on the way out.
+    """
+
+    def __init__(self, coro: Coroutine[Any, Any, "Client"]) -> None:
+        self.coro = coro
+        self.client: Optional[Client] = None
+
+    def __await__(self):
+        return self.coro.__await__()
+
+    async def __aenter__(self) -> "Client":
+        self.client = await self.coro
+        return self.client
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.client.close()
+
+
 class Client:
     """
     Client for the QuietCool QuietFan API.
@@ -14,18 +87,39 @@ class Client:
     WARNING: Don't instantiate this class directly, use the create method.
     """
 
-    def __init__(self, api_id: str, device: Device) -> None:
+    def __init__(
+        self,
+        api_id: str,
+        device: Device,
+        pool: Optional[ConnectionPool] = None,
+        debounce: float = 0.0,
+    ) -> None:
         self.api_id = api_id
         self.device = device
-        self.api = Api(self.device, self.api_id)
+        # the pool the device was taken from, if any
+        self.pool = pool
+        self.closed = False
+        self.api = Api(self.device, self.api_id, debounce=debounce)
 
     @classmethod
-    async def create(
-        cls, api_id: Optional[str] = None, device: Optional[Device] = None
-    ) -> Self:
+    def create(
+        cls,
+        api_id: Optional[str] = None,
+        device: Optional[Device] = None,
+        address: Optional[str] = None,
+        probe: bool = False,
+        pool: Optional[ConnectionPool] = None,
+        debounce: float = 0.0,
+    ) -> _Creating:
         """
         Create a new Client instance.
 
+        Can be awaited, or used as an async context manager to close the
+        client automatically:
+
+            async with Client.create() as client:
+                ...
+
         Args:
             api_id: The API ID to use for authentication. If not provided, will check:
                    1. QUIETCOOL environment variable
@@ -33,8 +127,19 @@ class Client:
                    3. ~/.quietcool file
                    4. /etc/quietcool file
                    The first found value will be used.
-            device: Optional Device instance. If not provided, will attempt to discover
-                   a fan on the network using Device.find_fan()
+            device: Optional Device instance. If not provided, a connection is
+                   taken from the process-wide pool, reusing a live connection
+                   to the fan if there is one, or else discovering a fan on the
+                   network using Device.find_fan()
+            address: Optional BLE address of the fan to connect to
+            probe: Whether to probe the fan's firmware capabilities (see
+                   Api.probe_capabilities), so that unsupported commands fail
+                   fast. Results are cached per serial number and version.
+            pool: The ConnectionPool to take a connection from when no device
+                   is given; defaults to the process-wide pool
+            debounce: Seconds to hold back settings that are typically
+                   dragged through a range of values, sending only the last
+                   (see Api); 0 sends every one
 
         Returns:
             A connected Client instance
@@ -42,15 +147,53 @@ class Client:
         Raises:
             ValueError: If no API ID is provided and none can be found in the expected locations
         """
+        return _Creating(cls._create(api_id, device, address, probe, pool, debounce))
+
+    @classmethod
+    @traced("client.create")
+    async def _create(
+        cls,
+        api_id: Optional[str],
+        device: Optional[Device],
+        address: Optional[str],
+        probe: bool,
+        pool: Optional[ConnectionPool],
+        debounce: float,
+    ) -> Self:
         if api_id is None:
             api_id = cls._find_api_id()
 
-        if device is None:
-            device = await Device.find_fan()
-
-        client = cls(api_id, device)
+        if device is not None:
+            client = cls(api_id, device, debounce=debounce)
+        else:
+            pool = pool if pool is not None else shared_pool
+            client = cls(api_id, await pool.acquire(address), pool, debounce)
+        if probe:
+            try:
+                await client.api.probe_capabilities()
+            except BaseException:
+                await client.close()
+                raise
         return client
 
+    async def close(self) -> None:
+        """
+        Close the client. A pooled connection is handed back to the pool,
+        which disconnects it once it has been idle for a while; a Device
+        passed to create is left alone for its owner to disconnect.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.pool is not None:
+            self.pool.release(self.device)
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
     @staticmethod
     def _find_api_id() -> str:
         # Check environment variable
@@ -74,6 +217,7 @@ class Client:
             "No API ID provided and none found in environment or config files"
         )
 
+    @traced("client.pair")
     async def pair(self) -> None:
         login_result = await self.api.send_login()
         if login_result["Result"] == "Success":
@@ -89,19 +233,193 @@ class Client:
         else:
             logger.info("Pairing failed")
 
-    async def get_info(self) -> dict:
-        faninfo = await self.api.get_fan_info()
-        params = await self.api.get_parameters()
-        version = await self.api.get_version()
-        presets = await self.api.get_presets()
-        workstate = await self.api.get_work_state()
-        return {
-            "faninfo": faninfo,
-            "params": params,
-            "version": version,
-            "presets": presets,
-            "workstate": workstate,
-        }
+    # section name -> Api method used to fetch it
+    SECTIONS = {
+        "faninfo": Api.get_fan_info,
+        "params": Api.get_parameters,
+        "version": Api.get_version,
+        "presets": Api.get_presets,
+        "workstate": Api.get_work_state,
+        "remain-time": Api.get_remain_time,
+    }
+    DEFAULT_SECTIONS = ("faninfo", "params", "version", "presets", "workstate")
+
+    @traced("client.get_info")
+    async def get_info(self, sections: Optional[Iterable[str]] = None) -> dict:
+        """
+        Fetch information about the fan, one round trip per section.
+
+        Args:
+            sections: Names of the sections to fetch (keys of Client.SECTIONS).
+                      Defaults to everything but remain-time.
+
+        Returns:
+            dict mapping each section name to its result
+
+        Raises:
+            ValueError: If a section name is unknown
+        """
+        if sections is None:
+            sections = self.DEFAULT_SECTIONS
+        info = {}
+        for section in sections:
+            if section not in self.SECTIONS:
+                raise ValueError(f"Unknown section: {section}")
+            info[section] = await self.SECTIONS[section](self.api)
+        return info
+
+    async def _reconnect(self) -> None:
+        await self.device.reconnect()
+        await self.api.ensure_logged_in()
+
+    async def upgrade_firmware(
+        self,
+        url: str,
+        ssid: str,
+        password: str,
+        timeout: float = 600.0,
+        initial_delay: float = 1.0,
+        max_delay: float = 30.0,
+        poll_timeout: float = 10.0,
+    ) -> AsyncIterator[UpgradeProgress]:
+        """
+        Upgrade the fan's firmware, yielding progress events as it goes.
+
+        Sends Upgrade and SetRouter, then polls GetUpgradeState with exponential
+        backoff until the fan reports it is done. If the link drops (the fan
+        reboots at the end of an upgrade) the fan is found again by address and
+        polling continues.
+
+        Args:
+            url: The URL to download the firmware from
+            ssid: The WiFi network the fan should download over
+            password: The WiFi network password
+            timeout: Seconds to wait for the upgrade to finish
+            initial_delay: First delay between polls, in seconds
+            max_delay: Longest delay between polls, in seconds
+            poll_timeout: Seconds to wait for each poll or reconnect before
+                giving up on it and trying again; a rebooting fan often goes
+                quiet before the link drops
+
+        Yields:
+            UpgradeProgress events, ending with a "done" event
+
+        Raises:
+            UpgradeError: If the fan rejects the upgrade or the router
+                settings, reports failure, or doesn't finish within *timeout*
+        """
+        start = time.monotonic()
+        address = self.device.address
+
+        def progress(stage: str, **kwargs) -> UpgradeProgress:
+            return UpgradeProgress(
+                address, stage, elapsed=time.monotonic() - start, **kwargs
+            )
+
+        response = await self.api.upgrade(url)
+        if response.flag != "TRUE":
+            yield progress("failed", error=f"Upgrade rejected: {response}")
+            raise UpgradeError(f"Upgrade rejected: {response}")
+        yield progress("upgrade")
+
+        router = await self.api.set_router(ssid, password)
+        if router.response.get("Flag") != "TRUE":
+            yield progress("failed", error=f"SetRouter rejected: {router}")
+            raise UpgradeError(f"SetRouter rejected: {router}")
+        yield progress("router")
+
+        state = None
+        poll_attempt = 0
+        reconnect_attempt = 0
+
+        def remaining() -> float:
+            return timeout - (time.monotonic() - start)
+
+        for delay in backoff_delays(initial_delay, max_delay):
+            if remaining() <= 0:
+                yield progress("failed", state=state, error="Timed out")
+                raise UpgradeError(f"Upgrade timed out in state {state}")
+            await asyncio.sleep(min(delay, remaining()))
+
+            try:
+                if not self.device.connected:
+                    reconnect_attempt += 1
+                    yield progress("reconnect", state=state, attempt=reconnect_attempt)
+                    await asyncio.wait_for(
+                        self._reconnect(), max(0.0, min(poll_timeout, remaining()))
+                    )
+                upgrade_state = await asyncio.wait_for(
+                    self.api.get_upgrade_state(),
+                    max(0.0, min(poll_timeout, remaining())),
+                )
+                state = upgrade_state.state
+            except (NotConnectedError, BleakError, asyncio.TimeoutError) as e:
+                logger.info("Lost fan %s during upgrade: %s", address, e)
+                continue
+
+            poll_attempt += 1
+            yield progress("poll", state=state, attempt=poll_attempt)
+            if state in UPGRADE_DONE_STATES:
+                yield progress("done", state=state)
+                return
+            if state in UPGRADE_FAILED_STATES:
+                yield progress("failed", state=state, error="Fan reported failure")
+                raise UpgradeError(f"Upgrade failed in state {state}")
+
+
+async def upgrade_fleet(
+    clients: Iterable[Client],
+    url: str,
+    ssid: str,
+    password: str,
+    concurrency: int = 2,
+    **kwargs,
+) -> AsyncIterator[UpgradeProgress]:
+    """
+    Roll a firmware upgrade across many fans, at most *concurrency* at a time.
+
+    Progress events from all fans are yielded as they happen; use
+    UpgradeProgress.address to tell them apart. A failing fan yields a "failed"
+    event but doesn't stop the others.
+
+    Args:
+        clients: Clients for the fans to upgrade
+        url, ssid, password: As for Client.upgrade_firmware
+        concurrency: Maximum number of fans upgrading at once
+        **kwargs: Passed through to Client.upgrade_firmware
+    """
+    events: asyncio.Queue[Optional[UpgradeProgress]] = asyncio.Queue()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def upgrade_one(client: Client) -> None:
+        try:
+            async with limit:
+                async for event in client.upgrade_firmware(
+                    url, ssid, password, **kwargs
+                ):
+                    await events.put(event)
+        except UpgradeError as e:
+            logger.warning("Upgrade of %s failed: %s", client.device.address, e)
+        except Exception as e:
+            logger.warning("Upgrade of %s failed: %s", client.device.address, e)
+            await events.put(
+                UpgradeProgress(client.device.address, "failed", error=str(e))
+            )
+        finally:
+            await events.put(None)
+
+    tasks = [asyncio.create_task(upgrade_one(client)) for client in clients]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            event = await events.get()
+            if event is None:
+                remaining -= 1
+            else:
+                yield event
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 # activate smart mode looks like:
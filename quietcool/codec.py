@@ -0,0 +1,73 @@
+"""
+JSON encoding and decoding, for both the BLE wire format and CLI output.
+
+Uses orjson or msgspec when one is installed (`pip install quietcool[fast]`)
+and falls back to the standard library otherwise. Dataclasses such as
+WorkState serialize natively with every backend.
+"""
+
+import json
+from dataclasses import asdict, is_dataclass
+from enum import Enum
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _default(obj: Any) -> Any:
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return asdict(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+    DecodeError = orjson.JSONDecodeError
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default)
+
+    def dumps_pretty(obj: Any) -> str:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_INDENT_2).decode()
+
+    loads = orjson.loads
+
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    DecodeError = msgspec.DecodeError
+    _encoder = msgspec.json.Encoder(enc_hook=_default)
+    _decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj)
+
+    def dumps_pretty(obj: Any) -> str:
+        return msgspec.json.format(_encoder.encode(obj), indent=2).decode()
+
+    loads = _decoder.decode
+
+else:
+    BACKEND = "json"
+    DecodeError = json.JSONDecodeError
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+    def dumps_pretty(obj: Any) -> str:
+        return json.dumps(obj, default=_default, indent=2)
+
+    loads = json.loads
+
+
+dumps.__doc__ = "Encode *obj* as compact JSON bytes."
+dumps_pretty.__doc__ = "Encode *obj* as indented JSON text, for people to read."
@@ -0,0 +1,75 @@
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable, Optional
+import asyncio
+import time
+
+from . import logger
+
+
+@dataclass
+class _Pending:
+    fn: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    started: float
+    superseded: int = 0
+    timer: Optional[asyncio.TimerHandle] = field(default=None, repr=False)
+
+
+class Debouncer:
+    """
+    Last-write-wins coalescing of rapid successive writes.
+
+    A write waits until no newer write with the same key has arrived for
+    *window* seconds (but never more than *max_delay* seconds in total), and
+    then only the newest is sent. Every caller in the batch, superseded or
+    not, gets the result of the write that was actually sent.
+
+    Attributes:
+        window: Quiet period, in seconds, before a write is sent
+        max_delay: Longest a write can be held back, in seconds
+    """
+
+    def __init__(self, window: float = 0.25, max_delay: Optional[float] = None) -> None:
+        self.window = window
+        self.max_delay = max_delay if max_delay is not None else window * 4
+        self.pending: dict[Hashable, _Pending] = {}
+
+    async def submit(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Queue fn() as the latest write for *key* and return the result of
+        whichever write ends up being sent.
+        """
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = _Pending(fn, loop.create_future(), now)
+            self.pending[key] = pending
+        else:
+            pending.fn = fn
+            pending.superseded += 1
+            pending.timer.cancel()
+
+        delay = min(self.window, pending.started + self.max_delay - now)
+        pending.timer = loop.call_later(max(delay, 0), self._fire, key, pending)
+        return await asyncio.shield(pending.future)
+
+    def _fire(self, key: Hashable, pending: _Pending) -> None:
+        # later writes for this key start a new batch from here on
+        if self.pending.get(key) is pending:
+            del self.pending[key]
+        if pending.superseded:
+            logger.debug("Sending %s, superseding %d writes", key, pending.superseded)
+        task = asyncio.ensure_future(pending.fn())
+        task.add_done_callback(lambda t: self._resolve(t, pending.future))
+
+    @staticmethod
+    def _resolve(task: asyncio.Task, future: asyncio.Future) -> None:
+        if future.done():
+            return
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
@@ -4,17 +4,35 @@ from bleak.backends.device import BLEDevice
 from bleak.backends.characteristic import BleakGATTCharacteristic
 from bleak.backends.service import BleakGATTService
 import asyncio
-import json
+import contextlib
+import logging
 from itertools import count, takewhile
-from typing import Iterator, Optional, Self
+from typing import Callable, Iterator, Optional, Self
+from . import codec
+from .capabilities import Capabilities
+from .discovery import DiscoveryCache
+from .packets import RX, RX_FRAME, TX, TX_FRAME, PacketLog
+from .scheduler import Scheduler, current_priority
+from .tracing import traced, tracer
 from . import logger
 
 
+class NotConnectedError(Exception):
+    """Raised when the fan is not connected, or disconnects mid-command."""
+
+
 class Device:
     SERVICE_UUID = "000000ff-0000-1000-8000-00805f9b34fb"
     CHARACTERISTIC_UUID = "0000ff01-0000-1000-8000-00805f9b34fb"
     #    UUID_KEY_NOTIFY = "00002902-0000-1000-8000-00805f9b34fb"
 
+    # set to a DiscoveryCache to share scan results with other processes
+    discovery: Optional[DiscoveryCache] = None
+    # a response still unparseable after this many packets is garbage
+    MAX_RESPONSE_PACKETS = 64
+    # swapped out for simulator.SimulatedClient in tests and soak runs
+    client_class: type = BleakClient
+
     def __init__(self, fan: BLEDevice) -> None:
         self.fan: BLEDevice = fan
         self.send_buffer: StringIO = StringIO()
@@ -25,18 +43,75 @@ class Device:
         self.characteristic: Optional[BleakGATTCharacteristic] = None
         self.data_waiting: asyncio.Semaphore = asyncio.Semaphore(0)
         self.packet_counter: int = 0
+        self.packets: PacketLog = PacketLog()
+        # one command at a time, since responses carry no id to match them up
+        # by, most urgent first
+        self.scheduler: Scheduler = Scheduler()
+        # seconds to wait for each response before giving up on it, so a
+        # lost response doesn't hold up the link; None to wait forever
+        self.response_timeout: Optional[float] = 5.0
+        # filled in by Api.probe_capabilities
+        self.capabilities: Optional[Capabilities] = None
+        # Bluetooth adapter to connect through, e.g. "hci1"; None for the default
+        self.adapter: Optional[str] = None
+        # incremented on every connect, so per-connection state (like being
+        # logged in) can tell when it's stale
+        self.connections: int = 0
+        # called with the device when the link drops, but not when it's closed
+        # by disconnect()
+        self.disconnect_listeners: list[Callable[[Self], None]] = []
+        self._disconnecting = False
 
         logger.info("Created device for fan: %s", self.fan.name)
 
+    @staticmethod
+    async def scan(address: Optional[str] = None) -> Optional[BLEDevice]:
+        """
+        Scan once for a fan, either any fan or the one with the given address.
+        """
+        if address is not None:
+            return await BleakScanner.find_device_by_address(address, timeout=3)
+        return await BleakScanner.find_device_by_filter(
+            lambda d, ad: d.name and d.name.startswith("ATTICFAN"), timeout=3
+        )
+
     @classmethod
-    async def find_fan(cls) -> Self:
+    async def find_fan(cls, address: Optional[str] = None) -> Self:
+        """
+        Find a fan and connect to it.
+
+        If Device.discovery is set, recent scan results from any process on
+        this host are reused, so concurrent callers don't all scan at once.
+
+        Args:
+            address: Optional BLE address of the fan. If not provided, the first
+                     fan whose name starts with ATTICFAN is used.
+        """
         for attempt in range(3):
-            fan = await BleakScanner.find_device_by_filter(
-                lambda d, ad: d.name and d.name.startswith("ATTICFAN"), timeout=3
-            )
+            if cls.discovery is not None:
+                fan = await cls.discovery.find(address, cls.scan)
+            else:
+                fan = await cls.scan(address)
             if fan is not None:
                 ret = cls(fan)
-                await ret.connect()
+                # a fan cached without backend details (i.e. not on BlueZ)
+                # has bleak scan for its address itself while connecting; do
+                # that under the discovery lock too, so processes reusing the
+                # cache still scan one at a time
+                if fan.details is None and cls.discovery is not None:
+                    lock = cls.discovery.locked()
+                else:
+                    lock = contextlib.nullcontext()
+                try:
+                    async with lock:
+                        await ret.connect()
+                except Exception as e:
+                    if cls.discovery is None or attempt == 2:
+                        raise
+                    # the cached result may be stale; scan for real next time
+                    logger.info("Connecting to cached %s failed: %s", fan.address, e)
+                    await cls.discovery.forget(fan.address)
+                    continue
                 return ret
 
             if attempt < 2:  # Don't sleep after last attempt
@@ -54,14 +129,48 @@ class Device:
         """
         return takewhile(len, (data[i : i + n] for i in count(0, n)))
 
+    @property
+    def address(self) -> str:
+        return self.fan.address
+
     def handle_disconnect(self, _: BleakClient) -> None:
         logger.info("Device was disconnected, goodbye.")
         self.connected = False
-        for task in asyncio.all_tasks():
-            task.cancel()
+        # wake up anyone waiting in get_response so they can notice
+        self.data_waiting.release()
+        if not self._disconnecting:
+            for listener in list(self.disconnect_listeners):
+                try:
+                    listener(self)
+                except Exception:
+                    logger.exception("Disconnect listener %r failed", listener)
+
+    def reset_buffers(self) -> None:
+        self.receive_buffer = StringIO()
+        self.data_waiting = asyncio.Semaphore(0)
+        self.packet_counter = 0
+
+    async def reconnect(self, fan: Optional[BLEDevice] = None) -> None:
+        """
+        Connect to this fan again, through *fan* if given (e.g. as found by a
+        scan on another adapter), or else after rescanning for it by address.
+
+        Used after the fan drops the link, e.g. when it reboots after a
+        firmware upgrade.
+
+        Raises:
+            NotConnectedError: If the fan can't be found by address.
+        """
+        if fan is None:
+            fan = await self.scan(self.address)
+        if fan is None:
+            raise NotConnectedError(f"Fan {self.address} not found")
+        self.fan = fan
+        self.reset_buffers()
+        await self.connect()
 
     def handle_rx(self, _: BleakGATTCharacteristic, data: bytearray) -> None:
-        logger.debug("received: %s", data)
+        self.packets.record(RX, data)
         str = data.decode("utf-8")
         self.receive_buffer.write(str)
         self.data_waiting.release()
@@ -78,37 +187,59 @@ class Device:
             dict: The parsed JSON response from the fan device.
 
         Raises:
-            Exception: If the device is not connected.
-            json.JSONDecodeError: Handled internally for partial messages.
+            NotConnectedError: If the device is not connected, or disconnects
+                while waiting.
+            codec.DecodeError: If no complete message can be parsed after
+                MAX_RESPONSE_PACKETS packets; partial messages are handled
+                internally.
 
         Note:
             - Resets the packet counter and receive buffer after successful parsing
             - Will keep trying to parse until a complete JSON message is received
         """
         if not self.connected:
-            raise Exception("Not connected")
+            raise NotConnectedError("Not connected")
 
         while True:
-            await self.data_waiting.acquire()
-            try:
-                value = json.loads(self.receive_buffer.getvalue())
-                logger.debug(
-                    "Received response %s in %d packets", value, self.packet_counter
-                )
-                self.packet_counter = 0
-                self.receive_buffer = StringIO()
-                return value
-            except json.JSONDecodeError:
-                # message is not complete yet
+            with tracer.span("device.wait"):
+                await self.data_waiting.acquire()
+            if not self.connected:
+                self.packets.dump("disconnected while waiting", level=logging.INFO)
+                raise NotConnectedError("Disconnected while waiting for response")
+            partial: Optional[codec.DecodeError] = None
+            with tracer.span("device.decode", packets=self.packet_counter + 1) as span:
+                try:
+                    value = codec.loads(self.receive_buffer.getvalue())
+                except codec.DecodeError as e:
+                    # message is not complete yet, which is expected rather
+                    # than an error in the span
+                    partial = e
+                if span is not None:
+                    span.attributes["complete"] = partial is None
+            if partial is not None:
                 self.packet_counter += 1
+                if self.packet_counter >= self.MAX_RESPONSE_PACKETS:
+                    self.packets.dump("undecodable response")
+                    self.reset_buffers()
+                    raise partial
                 continue
+            self.packets.record(RX_FRAME, self.receive_buffer.getvalue().encode())
+            self.packet_counter = 0
+            self.receive_buffer = StringIO()
+            return value
 
+    @traced("device.connect")
     async def connect(self) -> None:
-        self.client = BleakClient(
-            self.fan, disconnected_callback=self.handle_disconnect
+        # fans cached by a backend other than BlueZ have no details; bleak
+        # can look those up itself from the address
+        self.client = self.client_class(
+            self.fan if self.fan.details is not None else self.fan.address,
+            disconnected_callback=self.handle_disconnect,
+            **({"bluez": {"adapter": self.adapter}} if self.adapter else {}),
         )
         await self.client.connect()
         self.connected = True
+        self.connections += 1
         logger.info("Connected to %s", self.fan.name)
         await self.client.start_notify(Device.CHARACTERISTIC_UUID, self.handle_rx)
         logger.debug("Started notify")
@@ -125,6 +256,19 @@ class Device:
             raise Exception("Characteristic not found")
         logger.debug("Found characteristic: %s", self.characteristic.description)
 
+    async def disconnect(self) -> None:
+        """
+        Disconnect from the fan. Safe to call if already disconnected.
+        """
+        if self.client is not None and self.connected:
+            self._disconnecting = True
+            try:
+                await self.client.disconnect()
+            finally:
+                self._disconnecting = False
+            logger.info("Disconnected from %s", self.fan.name)
+        self.connected = False
+
     async def send_message(self, message: bytes) -> None:
         """
         Sends a raw byte message to the fan device, handling chunking for large messages.
@@ -136,25 +280,27 @@ class Device:
             message (bytes): The raw message to send to the device.
 
         Raises:
-            Exception: If the device is not connected.
+            NotConnectedError: If the device is not connected.
         """
         if not self.connected:
-            raise Exception("Not connected")
+            raise NotConnectedError("Not connected")
 
         for s in self.sliced(
             message, self.characteristic.max_write_without_response_size
         ):
-            response = await self.client.write_gatt_char(
-                self.characteristic, s, response=True
-            )
-            logger.debug("Sent %s (%d bytes), response: %s", s, len(s), response)
+            self.packets.record(TX, s)
+            with tracer.span("device.write", length=len(s)):
+                await self.client.write_gatt_char(self.characteristic, s, response=True)
 
     async def send_command(self, **kwargs) -> dict:
         """
         Sends a command to the device as a JSON message and waits for the response.
 
         This method converts the provided keyword arguments into a JSON message,
-        sends it to the device, and waits for a response.
+        sends it to the device, and waits for a response. Commands are queued
+        on the device's Scheduler at the priority given by
+        scheduler.current_priority, and identical telemetry reads that are
+        already queued are coalesced.
 
         Args:
             **kwargs: Keyword arguments that will be converted to a JSON message.
@@ -164,15 +310,56 @@ class Device:
             dict: The parsed JSON response from the fan device.
 
         Raises:
-            Exception: If the device is not connected.
-            json.JSONDecodeError: If the response cannot be parsed as JSON.
+            NotConnectedError: If the device is not connected.
+            codec.DecodeError: If the response cannot be parsed as JSON.
+            scheduler.QueueFullError: If the command's queue is full.
+            TimeoutError: If no response arrives within response_timeout.
 
         Example:
             response = await device.send_command(command="SetMode", Mode="Idle")
         """
         if not self.connected:
-            raise Exception("Not connected")
+            raise NotConnectedError("Not connected")
+
+        payload = codec.dumps(kwargs)
+        command = kwargs.get("Api", "")
+        priority = current_priority(command)
+
+        async def receive() -> dict:
+            while True:
+                response = await self.get_response()
+                # a late response to a command that timed out can turn up
+                # first; responses echo the command they answer
+                if response.get("Api", command) == command:
+                    return response
+                self.packets.dump(
+                    f"discarded {response.get('Api')} response to {command}",
+                    level=logging.INFO,
+                )
+
+        async def exchange() -> dict:
+            self.packets.record(TX_FRAME, payload)
+            try:
+                await self.send_message(payload)
+                return await asyncio.wait_for(receive(), self.response_timeout)
+            except asyncio.CancelledError:
+                # almost always a caller timing out on a response; whatever
+                # part of it has arrived would corrupt the next one
+                self.packets.dump(f"{command} cancelled", level=logging.INFO)
+                self.reset_buffers()
+                raise
+            except TimeoutError:
+                # the response was lost; give up on it so the commands queued
+                # behind this one get their turn
+                self.packets.dump(f"no response to {command}", level=logging.INFO)
+                self.reset_buffers()
+                raise
+            except (NotConnectedError, codec.DecodeError):
+                # already dumped, if worth dumping
+                raise
+            except Exception as e:
+                self.packets.dump(f"{command} failed: {e!r}")
+                raise
 
-        payload = json.dumps(kwargs).encode("utf-8")
-        await self.send_message(payload)
-        return await self.get_response()
+        with tracer.span("device.command", command=command, priority=priority.name):
+            return await self.scheduler.submit(exchange, priority, key=payload)
@@ -0,0 +1,146 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
+import asyncio
+import json
+import pathlib
+import time
+
+from bleak.backends.device import BLEDevice
+
+from . import cache_dir, logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+Scan = Callable[[Optional[str]], Awaitable[Optional[BLEDevice]]]
+
+
+def _saved_details(fan: BLEDevice) -> Optional[dict]:
+    # on BlueZ, the fan's D-Bus object path is all bleak needs to connect
+    # without scanning, plus the properties it reads back from it; other
+    # backends' details are live OS objects that can't be saved
+    details = fan.details
+    if not isinstance(details, dict) or "path" not in details:
+        return None
+    props = details.get("props") or {}
+    return {
+        "path": details["path"],
+        "props": {key: props[key] for key in ("Adapter", "Alias") if key in props},
+    }
+
+
+class DiscoveryCache:
+    """
+    Scan results shared between processes on the same host.
+
+    Scans happen with a lock file held, so only one process scans at a time;
+    the others wait for the lock and then reuse what it found, as long as the
+    result is less than *max_age* seconds old.
+
+    On BlueZ, a cached fan keeps its D-Bus object path, so connecting to it
+    doesn't scan again. Other backends' details can't be saved, so there the
+    fan comes back without them and bleak finds it by address with a scan of
+    its own; Device.find_fan holds the lock while connecting to such a fan.
+
+    Not used unless Device.discovery is set to one.
+
+    Attributes:
+        path: The JSON file holding scan results; defaults to discovery.json in
+              cache_dir()
+        lock_path: The lock file, next to *path*
+        max_age: Seconds a scan result stays fresh
+    """
+
+    def __init__(
+        self, path: Optional[pathlib.Path] = None, max_age: float = 300.0
+    ) -> None:
+        self.path = path if path is not None else cache_dir() / "discovery.json"
+        self.lock_path = self.path.with_suffix(".lock")
+        self.max_age = max_age
+
+    @asynccontextmanager
+    async def locked(self) -> AsyncIterator[None]:
+        """
+        Hold the lock file, waiting in a thread so the event loop keeps running.
+        """
+        if fcntl is None:
+            yield
+            return
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> dict[str, dict]:
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable discovery cache %s: %s", self.path, e)
+            return {}
+
+    def _write(self, entries: dict[str, dict]) -> None:
+        try:
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(entries, indent=2))
+            tmp.replace(self.path)
+        except OSError as e:
+            logger.warning("Couldn't save discovery cache %s: %s", self.path, e)
+
+    def _lookup(
+        self, entries: dict[str, dict], address: Optional[str]
+    ) -> Optional[BLEDevice]:
+        now = time.time()
+        fresh = {
+            addr: entry
+            for addr, entry in entries.items()
+            if now - entry["seen"] < self.max_age
+        }
+        if address is not None:
+            entry = fresh.get(address)
+        else:
+            # the fan seen most recently, as a scan would most likely find it
+            address, entry = max(
+                fresh.items(), key=lambda item: item[1]["seen"], default=(None, None)
+            )
+        if entry is None:
+            return None
+        return BLEDevice(address, entry["name"], entry.get("details"))
+
+    async def find(self, address: Optional[str], scan: Scan) -> Optional[BLEDevice]:
+        """
+        Return a fresh cached fan (the one at *address*, if given), or else
+        call *scan* with the lock held and cache what it finds.
+        """
+        async with self.locked():
+            entries = self._read()
+            fan = self._lookup(entries, address)
+            if fan is not None:
+                logger.debug("Using cached scan result for %s", fan.address)
+                return fan
+
+            fan = await scan(address)
+            if fan is not None:
+                entries[fan.address] = {
+                    "name": fan.name,
+                    "details": _saved_details(fan),
+                    "seen": time.time(),
+                }
+                self._write(entries)
+            return fan
+
+    async def forget(self, address: str) -> None:
+        """
+        Drop a cached fan, e.g. because connecting to it failed.
+        """
+        async with self.locked():
+            entries = self._read()
+            if entries.pop(address, None) is not None:
+                self._write(entries)
@@ -0,0 +1,236 @@
+"""
+Bridges fans onto an MQTT broker.
+
+Each fan is polled over its one Client and its state is published as retained
+JSON, only when it changes, so any number of subscribers can follow it without
+adding BLE traffic:
+
+    {prefix}/{fan}/workstate    WorkState
+    {prefix}/{fan}/parameters   Parameters
+    {prefix}/status             "online" while the bridge runs, else "offline"
+
+Commands are taken from:
+
+    {prefix}/{fan}/set/mode           idle, smart or timer
+    {prefix}/{fan}/set/temp_humidity  JSON object of set_temp_humidity arguments
+    {prefix}/{fan}/set/time           JSON object of set_time arguments
+
+Arguments left out of a JSON command keep their current values. Failed
+commands are reported on {prefix}/{fan}/error.
+
+Requires the aiomqtt package (`pip install quietcool[mqtt]`).
+"""
+
+from dataclasses import asdict
+from typing import Any, Optional
+import asyncio
+import contextlib
+
+try:
+    import aiomqtt
+except ImportError:
+    aiomqtt = None
+
+from .api import HumidityRange, Mode, Parameters, WorkState
+from .client import Client
+from .poller import Poller
+from . import codec, logger
+
+TEMP_HUMIDITY_FIELDS = (
+    "temp_high",
+    "temp_medium",
+    "temp_low",
+    "humidity_high",
+    "humidity_low",
+    "humidity_range",
+)
+TIME_FIELDS = ("hour", "minute", "time_range")
+
+
+def fan_name(client: Client) -> str:
+    """
+    Topic-safe name for a fan: its address without separators, lowercased.
+    """
+    return "".join(c for c in client.device.address if c.isalnum()).lower()
+
+
+class BridgedFan:
+    """
+    One fan's side of the bridge: polls it and publishes what changed.
+
+    Attributes:
+        name: The fan's topic name
+        client: The Client used for every BLE exchange with the fan
+        poller: Polls the fan's work state
+        parameters: The most recently read Parameters, or None
+        published: The last payload published on each topic
+    """
+
+    def __init__(
+        self, bridge: "MqttBridge", name: str, client: Client, interval: float
+    ) -> None:
+        self.bridge = bridge
+        self.name = name
+        self.client = client
+        self.poller = Poller(client.api, interval)
+        self.poller.subscribe(self.on_state)
+        self.parameters: Optional[Parameters] = None
+        self.published: dict[str, bytes] = {}
+        # keeps the fan's commands in the order they arrived
+        self.lock = asyncio.Lock()
+
+    def topic(self, suffix: str) -> str:
+        return f"{self.bridge.prefix}/{self.name}/{suffix}"
+
+    async def publish(self, suffix: str, value: Any) -> None:
+        """
+        Publish *value* as retained JSON, unless it's what was last published.
+        """
+        payload = codec.dumps(value)
+        topic = self.topic(suffix)
+        if self.published.get(topic) == payload:
+            return
+        await self.bridge.mqtt.publish(topic, payload, qos=1, retain=True)
+        self.published[topic] = payload
+
+    async def on_state(self, state: WorkState) -> None:
+        await self.publish("workstate", state)
+        self.parameters = await self.client.api.get_parameters()
+        await self.publish("parameters", self.parameters)
+
+    async def current(self, fields: tuple[str, ...]) -> dict:
+        if self.parameters is None:
+            self.parameters = await self.client.api.get_parameters()
+        values = asdict(self.parameters)
+        return {name: values[name] for name in fields}
+
+    async def command(self, name: str, payload: bytes) -> None:
+        """
+        Run the command published on {prefix}/{fan}/set/*name*, then poll so
+        the state topics reflect it straight away.
+        """
+        async with self.lock:
+            await self._command(name, payload)
+
+    async def _command(self, name: str, payload: bytes) -> None:
+        api = self.client.api
+        try:
+            if name == "mode":
+                await api.set_mode(Mode.parse(payload.decode().strip().strip('"')))
+            elif name == "temp_humidity":
+                args = await self.current(TEMP_HUMIDITY_FIELDS)
+                args.update(self.arguments(payload, TEMP_HUMIDITY_FIELDS))
+                args["humidity_range"] = HumidityRange(args["humidity_range"].upper())
+                await api.set_temp_humidity(**args)
+            elif name == "time":
+                args = await self.current(TIME_FIELDS)
+                args.update(self.arguments(payload, TIME_FIELDS))
+                await api.set_time(**args)
+            else:
+                raise ValueError(f"Unknown command: {name}")
+        except Exception as e:
+            logger.warning("MQTT command %s for %s failed: %s", name, self.name, e)
+            await self.bridge.mqtt.publish(
+                self.topic("error"), codec.dumps({"command": name, "error": str(e)})
+            )
+            return
+        try:
+            await self.poller.poll()
+        except Exception as e:
+            logger.warning("Polling work state failed: %s", e)
+
+    @staticmethod
+    def arguments(payload: bytes, fields: tuple[str, ...]) -> dict:
+        args = codec.loads(payload)
+        if not isinstance(args, dict):
+            raise ValueError("Expected a JSON object")
+        unknown = set(args) - set(fields)
+        if unknown:
+            raise ValueError(f"Unknown arguments: {', '.join(sorted(unknown))}")
+        return args
+
+
+class MqttBridge:
+    """
+    Publishes the state of one or more fans to MQTT and applies commands sent
+    back over it.
+
+    Attributes:
+        mqtt: A connected aiomqtt.Client
+        prefix: Topic prefix
+        fans: The BridgedFans, by topic name
+    """
+
+    def __init__(
+        self,
+        mqtt: Any,
+        clients: list[Client],
+        prefix: str = "quietcool",
+        interval: float = 30.0,
+    ) -> None:
+        self.mqtt = mqtt
+        self.prefix = prefix
+        self.fans: dict[str, BridgedFan] = {}
+        self.tasks: set[asyncio.Task] = set()
+        for client in clients:
+            name = fan_name(client)
+            self.fans[name] = BridgedFan(self, name, client, interval)
+
+    async def handle(self, topic: str, payload: bytes) -> None:
+        parts = topic.split("/")
+        prefix = self.prefix.split("/")
+        if parts[: len(prefix)] != prefix:
+            return
+        match parts[len(prefix) :]:
+            case [name, "set", command] if name in self.fans:
+                # so one slow fan doesn't hold up messages for the others
+                task = asyncio.create_task(self.fans[name].command(command, payload))
+                self.tasks.add(task)
+                task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("MQTT command failed", exc_info=task.exception())
+
+    async def run(self) -> None:
+        """
+        Announce the bridge, poll every fan and handle commands until
+        cancelled.
+        """
+        await self.mqtt.publish(f"{self.prefix}/status", b"online", qos=1, retain=True)
+        await self.mqtt.subscribe(f"{self.prefix}/+/set/+", qos=1)
+        for fan in self.fans.values():
+            fan.poller.start()
+        try:
+            async for message in self.mqtt.messages:
+                await self.handle(message.topic.value, bytes(message.payload))
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            for fan in self.fans.values():
+                await fan.poller.stop()
+
+
+async def bridge(
+    clients: list[Client],
+    hostname: str = "localhost",
+    port: int = 1883,
+    prefix: str = "quietcool",
+    interval: float = 30.0,
+    **kwargs,
+) -> None:
+    """
+    Connect to the broker at *hostname* and run an MqttBridge for *clients*
+    until cancelled. Extra keyword arguments are passed to aiomqtt.Client,
+    e.g. username and password.
+    """
+    if aiomqtt is None:
+        raise ImportError("The MQTT bridge requires the aiomqtt package")
+    will = aiomqtt.Will(f"{prefix}/status", b"offline", qos=1, retain=True)
+    async with aiomqtt.Client(hostname, port, will=will, **kwargs) as mqtt:
+        try:
+            await MqttBridge(mqtt, clients, prefix, interval).run()
+        finally:
+            with contextlib.suppress(aiomqtt.MqttError):
+                await mqtt.publish(f"{prefix}/status", b"offline", qos=1, retain=True)
@@ -0,0 +1,59 @@
+from collections import deque
+from typing import Iterator, Optional, TextIO
+import logging
+import time
+
+from . import logger
+
+TX = "tx"  # a chunk written to the fan
+RX = "rx"  # a notification received from the fan
+TX_FRAME = "tx-frame"  # a whole command, before chunking
+RX_FRAME = "rx-frame"  # a whole response, once it parsed
+
+
+class PacketLog:
+    """
+    Ring buffer of the most recent packets and frames on a link.
+
+    Recording is a single deque append of (timestamp, direction, bytes), so it
+    is cheap enough to leave on all the time; the entries are only formatted
+    when the log is dumped, which Device does on errors, timeouts and decode
+    failures.
+
+    Attributes:
+        entries: (monotonic time, direction, data) tuples, oldest first
+    """
+
+    def __init__(self, maxlen: int = 256) -> None:
+        self.entries: deque[tuple[float, str, bytes]] = deque(maxlen=maxlen)
+
+    def record(self, direction: str, data: bytes) -> None:
+        self.entries.append((time.monotonic(), direction, bytes(data)))
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def lines(self) -> Iterator[str]:
+        """
+        The entries formatted one per line, timed relative to the newest.
+        """
+        if not self.entries:
+            return
+        end = self.entries[-1][0]
+        for at, direction, data in self.entries:
+            yield f"{at - end:+9.3f}s {direction:<8} {len(data):4d} {data!r}"
+
+    def dump(
+        self, reason: str, level: int = logging.WARNING, file: Optional[TextIO] = None
+    ) -> None:
+        """
+        Write the log to *file*, or to the logger at *level*, headed by *reason*.
+        """
+        if file is not None:
+            print(f"Packet log ({reason}):", file=file)
+            for line in self.lines():
+                print("  " + line, file=file)
+        elif logger.isEnabledFor(level):
+            logger.log(
+                level, "Packet log (%s):\n  %s", reason, "\n  ".join(self.lines())
+            )
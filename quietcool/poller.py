@@ -0,0 +1,73 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from .api import Api, WorkState
+from . import logger
+
+Listener = Callable[[WorkState], Awaitable[None]]
+
+
+class Poller:
+    """
+    Polls the fan's work state on a fixed interval and hands each reading to
+    every subscribed listener, so that many consumers share one BLE read.
+
+    Attributes:
+        api: The Api to poll
+        interval: Seconds between polls
+        last: The most recent WorkState, or None before the first poll
+    """
+
+    def __init__(self, api: Api, interval: float = 30.0) -> None:
+        self.api = api
+        self.interval = interval
+        self.last: Optional[WorkState] = None
+        self.listeners: list[Listener] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, listener: Listener) -> None:
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener: Listener) -> None:
+        self.listeners.remove(listener)
+
+    async def poll(self) -> WorkState:
+        """
+        Read the work state once and dispatch it to all listeners.
+        """
+        state = await self.api.get_work_state()
+        self.last = state
+        for listener in list(self.listeners):
+            try:
+                await listener(state)
+            except Exception:
+                logger.exception("Poller listener %r failed", listener)
+        return state
+
+    async def run(self) -> None:
+        """
+        Poll forever. Errors reading the fan are logged and retried on the next
+        tick.
+        """
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Polling work state failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
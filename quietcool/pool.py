@@ -0,0 +1,144 @@
+import asyncio
+from typing import Optional
+
+from .adapters import AdapterScheduler
+from .device import Device, NotConnectedError
+from . import logger
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of fan connections, keyed by fan address.
+
+    Clients acquire a Device from the pool and release it when they're done.
+    A released connection stays open for *idle_timeout* seconds so that the
+    next client for the same fan can pick it up without scanning and
+    connecting again.
+
+    Devices are bound to the event loop they were connected on, so when the
+    pool is used from a new loop (e.g. a second asyncio.run) connections
+    from the old one are dropped rather than handed out.
+
+    With an AdapterScheduler, a device whose link has dropped stays pooled
+    while the scheduler moves it to another adapter, and acquire waits for
+    that rather than connecting a second Device to the same fan.
+
+    Attributes:
+        idle_timeout: Seconds to keep an unused connection open
+        adapters: If set, new connections are placed across Bluetooth
+            adapters by this AdapterScheduler rather than with
+            Device.find_fan
+        devices: Pooled devices by address
+        users: Number of clients using each pooled device, by address
+    """
+
+    def __init__(
+        self, idle_timeout: float = 60.0, adapters: Optional[AdapterScheduler] = None
+    ) -> None:
+        self.idle_timeout = idle_timeout
+        self.adapters = adapters
+        self.devices: dict[str, Device] = {}
+        self.users: dict[str, int] = {}
+        self._closers: dict[str, asyncio.TimerHandle] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _check_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        if self.devices:
+            logger.debug("Dropping %d connections from another loop", len(self.devices))
+        for address in list(self.devices):
+            self._forget(address)
+        self._lock = None
+        self._loop = loop
+
+    def _recovering(self, device: Device) -> bool:
+        # the scheduler reconnects its own dropped devices in place
+        return (
+            self.adapters is not None
+            and self.adapters.devices.get(device.address) is device
+        )
+
+    def _live(self, address: Optional[str]) -> Optional[Device]:
+        for device in list(self.devices.values()):
+            if not device.connected and not self._recovering(device):
+                self._forget(device.address)
+            elif address is None or device.address == address:
+                return device
+        return None
+
+    def _forget(self, address: str) -> None:
+        device = self.devices.pop(address, None)
+        if device is not None and self.adapters is not None:
+            self.adapters.release(device)
+        self.users.pop(address, None)
+        if closer := self._closers.pop(address, None):
+            closer.cancel()
+
+    async def acquire(self, address: Optional[str] = None) -> Device:
+        """
+        Get a connected Device for the fan at *address*, reusing a live
+        connection if there is one. With no address, any live connection is
+        reused, otherwise the first fan found is connected.
+        """
+        self._check_loop()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            device = self._live(address)
+            if device is None:
+                if self.adapters is not None:
+                    device = await self.adapters.connect(address)
+                else:
+                    device = await Device.find_fan(address)
+                self.devices[device.address] = device
+                self.users[device.address] = 0
+            else:
+                logger.debug("Reusing connection to %s", device.address)
+                if not device.connected:
+                    try:
+                        await self.adapters.recover(device)
+                    except NotConnectedError:
+                        self._forget(device.address)
+                        raise
+            if closer := self._closers.pop(device.address, None):
+                closer.cancel()
+            self.users[device.address] += 1
+            return device
+
+    def release(self, device: Device) -> None:
+        """
+        Give a Device back to the pool. Once nobody is using it, it is
+        disconnected after the idle timeout.
+        """
+        address = device.address
+        if self.devices.get(address) is not device:
+            return
+        self.users[address] -= 1
+        if self.users[address] <= 0:
+            self._closers[address] = asyncio.get_running_loop().call_later(
+                self.idle_timeout, self._close_idle, device
+            )
+
+    def _close_idle(self, device: Device) -> None:
+        address = device.address
+        self._closers.pop(address, None)
+        if self.users.get(address, 0) <= 0 and self.devices.get(address) is device:
+            self._forget(address)
+            asyncio.create_task(device.disconnect())
+
+    async def close(self) -> None:
+        """
+        Disconnect every pooled device, in use or not.
+        """
+        self._check_loop()
+        devices = list(self.devices.values())
+        for address in list(self.devices):
+            self._forget(address)
+        for device in devices:
+            await device.disconnect()
+
+
+pool = ConnectionPool()
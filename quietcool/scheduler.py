@@ -0,0 +1,232 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import Context, ContextVar, copy_context
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Hashable, Iterator, Optional
+import asyncio
+import time
+
+from . import logger
+
+
+class Priority(IntEnum):
+    """Command priority classes, most urgent first."""
+
+    INTERACTIVE = 0
+    CONFIGURATION = 1
+    TELEMETRY = 2
+
+
+class QueueFullError(Exception):
+    """Raised when a command is refused, or dropped, because its queue is full."""
+
+
+INTERACTIVE_COMMANDS = frozenset({"Login", "SetMode", "Pair", "PairMode"})
+
+_priority: ContextVar[Optional[Priority]] = ContextVar(
+    "quietcool_priority", default=None
+)
+
+
+def classify(command: str) -> Priority:
+    """
+    The default priority for an Api command: mode changes and logins are
+    interactive, reads are telemetry, everything else is configuration.
+    """
+    if command in INTERACTIVE_COMMANDS:
+        return Priority.INTERACTIVE
+    if command.startswith("Get"):
+        return Priority.TELEMETRY
+    return Priority.CONFIGURATION
+
+
+@contextmanager
+def priority(value: Priority) -> Iterator[None]:
+    """
+    Run the commands sent inside the block at *value* instead of their default
+    priority, e.g. to make a read the user is waiting on interactive:
+
+        with priority(Priority.INTERACTIVE):
+            state = await api.get_work_state()
+    """
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority(command: str) -> Priority:
+    value = _priority.get()
+    return value if value is not None else classify(command)
+
+
+@dataclass
+class ClassMetrics:
+    """
+    Counters for one priority class.
+
+    Attributes:
+        depth: Commands currently queued
+        max_depth: Most commands ever queued at once
+        submitted: Commands submitted
+        completed: Commands sent to the fan
+        coalesced: Reads that shared an already-queued identical read
+        dropped: Commands refused or dropped because the queue was full
+        wait_total: Total seconds commands spent queued
+        wait_max: Longest a command spent queued, in seconds
+    """
+
+    depth: int = 0
+    max_depth: int = 0
+    submitted: int = 0
+    completed: int = 0
+    coalesced: int = 0
+    dropped: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+    @property
+    def wait_mean(self) -> float:
+        return self.wait_total / self.completed if self.completed else 0.0
+
+
+@dataclass
+class _Job:
+    fn: Callable[[], Awaitable[Any]]
+    key: Optional[Hashable]
+    future: asyncio.Future
+    queued_at: float
+    context: Context
+    waiters: int = 1
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+
+class Scheduler:
+    """
+    Runs commands on the BLE link one at a time, most urgent class first.
+
+    Each priority class has a bounded FIFO queue. Telemetry reads with the
+    same key as one already queued are coalesced onto it, and when the
+    telemetry queue is full its oldest read is dropped to make room, since a
+    newer one is about to replace it anyway. Full interactive and
+    configuration queues refuse new commands instead.
+
+    Attributes:
+        max_depth: Maximum queued commands per class
+        metrics: ClassMetrics for each class
+    """
+
+    def __init__(self, max_depth: int = 32) -> None:
+        self.max_depth = max_depth
+        self.queues: dict[Priority, deque[_Job]] = {p: deque() for p in Priority}
+        self.metrics: dict[Priority, ClassMetrics] = {
+            p: ClassMetrics() for p in Priority
+        }
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(
+        self,
+        fn: Callable[[], Awaitable[Any]],
+        priority: Priority = Priority.CONFIGURATION,
+        key: Optional[Hashable] = None,
+    ) -> Any:
+        """
+        Queue fn() to run once everything more urgent (and everything queued
+        before it in its class) has run, and return its result.
+
+        Args:
+            fn: Coroutine function performing the command
+            priority: The command's class
+            key: Identifies identical telemetry reads, to coalesce them
+
+        Raises:
+            QueueFullError: If the queue is full, or the read was dropped
+        """
+        queue = self.queues[priority]
+        metrics = self.metrics[priority]
+        metrics.submitted += 1
+
+        job = None
+        if priority == Priority.TELEMETRY and key is not None:
+            job = next((j for j in queue if j.key == key), None)
+        if job is not None:
+            metrics.coalesced += 1
+            job.waiters += 1
+        else:
+            if len(queue) >= self.max_depth:
+                metrics.dropped += 1
+                if priority != Priority.TELEMETRY:
+                    raise QueueFullError(f"{priority.name} queue is full")
+                stale = queue.popleft()
+                logger.debug("Dropping stale read %s", stale.key)
+                stale.future.set_exception(QueueFullError("Dropped under load"))
+            job = _Job(
+                fn,
+                key,
+                asyncio.get_running_loop().create_future(),
+                time.monotonic(),
+                # run in the caller's context, so tracing spans nest properly
+                copy_context(),
+            )
+            queue.append(job)
+            metrics.depth = len(queue)
+            metrics.max_depth = max(metrics.max_depth, metrics.depth)
+            if self._worker is None or self._worker.done():
+                self._worker = asyncio.create_task(self._run())
+
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            self._abandon(job, priority)
+            raise
+
+    def _abandon(self, job: _Job, priority: Priority) -> None:
+        # the last caller waiting on a job gave up: don't leave it running, or
+        # a command that never gets an answer would hold up the link forever
+        job.waiters -= 1
+        if job.waiters > 0:
+            return
+        if job.task is not None:
+            job.task.cancel()
+        elif job in self.queues[priority]:
+            self.queues[priority].remove(job)
+            self.metrics[priority].depth -= 1
+            job.future.cancel()
+
+    def _next(self) -> Optional[tuple[Priority, _Job]]:
+        for priority, queue in self.queues.items():
+            if queue:
+                job = queue.popleft()
+                self.metrics[priority].depth = len(queue)
+                return priority, job
+        return None
+
+    async def _run(self) -> None:
+        while (item := self._next()) is not None:
+            priority, job = item
+            if job.future.done():
+                continue
+            metrics = self.metrics[priority]
+            wait = time.monotonic() - job.queued_at
+            metrics.wait_total += wait
+            metrics.wait_max = max(metrics.wait_max, wait)
+            metrics.completed += 1
+
+            job.task = asyncio.get_running_loop().create_task(
+                job.fn(), context=job.context
+            )
+            try:
+                result = await asyncio.shield(job.task)
+            except asyncio.CancelledError:
+                if not job.task.cancelled():
+                    # the worker itself is being cancelled
+                    job.task.cancel()
+                    job.future.cancel()
+                    raise
+                job.future.cancel()
+            except Exception as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
@@ -0,0 +1,297 @@
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
+import asyncio
+import random
+import time
+
+from bleak.backends.device import BLEDevice
+
+from .device import Device
+from . import codec
+
+
+@dataclass
+class SimulatedLink:
+    """
+    Knobs for the simulated radio link.
+
+    Attributes:
+        mtu: Size of the notification chunks responses are split into
+        write_size: max_write_without_response_size reported to Device
+        drop_rate: Probability of each notification chunk being lost; the
+            rest of the response is lost with it, as when the link stalls,
+            so what arrives is a prefix that never decodes
+        drop_responses: Number of upcoming responses to lose entirely
+        latency: Seconds before each notification is delivered
+        seed: Seed for the drop decisions, for repeatable runs
+    """
+
+    mtu: int = 20
+    write_size: int = 20
+    drop_rate: float = 0.0
+    drop_responses: int = 0
+    latency: float = 0.0
+    seed: Optional[int] = None
+
+
+@dataclass
+class SimulatedFan:
+    """
+    A fan that answers Api commands from in-memory state.
+
+    Attributes:
+        address: The fan's BLE address
+        name: The fan's BLE name
+        link: How the link to the fan behaves
+        rssi: Signal strength reported when scanning
+        adapters: RSSI per adapter name, for fans only some adapters can reach;
+            None for a fan every adapter hears at *rssi*
+        state: The fan's settings, as they appear in responses
+        commands: Number of commands handled
+        timer_started: Monotonic time Timer mode was entered; the timer counts
+            down from state["RemainSecond"] from then on
+    """
+
+    address: str = "SIM:00:00:00:00:01"
+    name: str = "ATTICFAN_SIM"
+    link: SimulatedLink = field(default_factory=SimulatedLink)
+    rssi: int = -60
+    adapters: Optional[dict[str, int]] = None
+    state: dict = field(
+        default_factory=lambda: {
+            "Mode": "Idle",
+            "FanType": "THREE",
+            "Temp_Sample": 713,
+            "Humidity_Sample": 36,
+            "SetTemp_H": 120,
+            "SetTemp_M": 100,
+            "SetTemp_L": 80,
+            "SetHum_H": 90,
+            "SetHum_L": 255,
+            "SetHum_Range": "LOW",
+            "SetHour": 1,
+            "SetMinute": 0,
+            "SetTime_Range": "MEDIUM",
+            "RemainSecond": 3600,
+        }
+    )
+    commands: int = 0
+    timer_started: Optional[float] = field(default=None, repr=False)
+
+    def ble_device(self) -> BLEDevice:
+        return BLEDevice(self.address, self.name, None)
+
+    def rssi_on(self, adapter: Optional[str]) -> Optional[int]:
+        """
+        The fan's signal strength on *adapter*, or None if it's out of range.
+        """
+        if self.adapters is None or adapter is None:
+            return self.rssi
+        return self.adapters.get(adapter)
+
+    def handle(self, request: dict) -> dict:
+        """
+        Return the fan's response to *request*.
+        """
+        self.commands += 1
+        s = self.state
+        api = request.get("Api")
+        match api:
+            case "Login" | "Pair":
+                return {"Api": api, "Result": "Success", "PairState": "No"}
+            case "GetFanInfo":
+                return {
+                    "Api": api,
+                    "Name": "sim fan",
+                    "Model": "7",
+                    "SerialNum": "SIM1",
+                }
+            case "GetVersion":
+                return {
+                    "Api": api,
+                    "Version": "IT-BLT-ATTICFAN_SIM",
+                    "ProtectTemp": 182,
+                    "Create_Date": "2024.01.01",
+                    "Create_Mode": "online",
+                    "HW_Version": "A",
+                }
+            case "GetWorkState":
+                return {
+                    "Api": api,
+                    "Mode": s["Mode"],
+                    "Range": "CLOSE",
+                    "SensorState": "OK",
+                    "Temp_Sample": s["Temp_Sample"],
+                    "Humidity_Sample": s["Humidity_Sample"],
+                }
+            case "GetParameter":
+                return {
+                    "Api": api,
+                    "Mode": s["Mode"],
+                    "FanType": s["FanType"],
+                    "GetTemp_H": s["SetTemp_H"],
+                    "GetTemp_M": s["SetTemp_M"],
+                    "GetTemp_L": s["SetTemp_L"],
+                    "GetHum_H": s["SetHum_H"],
+                    "GetHum_L": s["SetHum_L"],
+                    "GetHum_Range": s["SetHum_Range"],
+                    "GetHour": s["SetHour"],
+                    "GetMinute": s["SetMinute"],
+                    "GetTime_Range": s["SetTime_Range"],
+                }
+            case "GetPresets":
+                return {
+                    "Api": api,
+                    "Presets": [["Summer", 120, 100, 80, 90, 255, "LOW"]],
+                }
+            case "GetRemainTime":
+                seconds = s["RemainSecond"]
+                if s["Mode"] == "Timer" and self.timer_started is not None:
+                    elapsed = int(time.monotonic() - self.timer_started)
+                    seconds = max(0, seconds - elapsed)
+                return {
+                    "Api": api,
+                    "RemainHour": seconds // 3600,
+                    "RemainMinute": seconds // 60 % 60,
+                    "RemainSecond": seconds % 60,
+                }
+            case "GetUpgradeState":
+                return {"Api": api, "State": "Success"}
+            case "SetMode":
+                if request["Mode"] == "Timer" and s["Mode"] != "Timer":
+                    s["RemainSecond"] = s["SetHour"] * 3600 + s["SetMinute"] * 60
+                    self.timer_started = time.monotonic()
+                s["Mode"] = request["Mode"]
+                return {"Api": api, "WorkMode": s["Mode"], "Flag": "TRUE"}
+            case "SetTempHumidity" | "SetTime":
+                s.update((k, v) for k, v in request.items() if k != "Api")
+                return {"Api": api, "Flag": "TRUE"}
+            case _:
+                return {"Api": api, "Flag": "TRUE"}
+
+
+class _Characteristic:
+    description = "simulated characteristic"
+
+    def __init__(self, write_size: int) -> None:
+        self.max_write_without_response_size = write_size
+
+
+class _Service:
+    description = "simulated service"
+
+    def __init__(self, characteristic: _Characteristic) -> None:
+        self.characteristic = characteristic
+
+    def get_characteristic(self, _: str) -> _Characteristic:
+        return self.characteristic
+
+
+class _Services:
+    def __init__(self, service: _Service) -> None:
+        self.service = service
+
+    def get_service(self, _: str) -> _Service:
+        return self.service
+
+
+class SimulatedClient:
+    """
+    Stands in for BleakClient, talking to SimulatedFans registered with
+    SimulatedClient.fans instead of a radio.
+
+    Responses are split into link.mtu sized notifications, some of which are
+    dropped at link.drop_rate, so Device's reassembly and timeout handling get
+    exercised.
+    """
+
+    fans: dict[str, SimulatedFan] = {}
+
+    def __init__(
+        self,
+        address_or_ble_device: Union[BLEDevice, str],
+        disconnected_callback: Optional[Callable] = None,
+        **kwargs,
+    ) -> None:
+        address = getattr(address_or_ble_device, "address", address_or_ble_device)
+        self.fan = self.fans[address]
+        self.kwargs = kwargs
+        self.adapter = kwargs.get("bluez", {}).get("adapter")
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.services = _Services(_Service(_Characteristic(self.fan.link.write_size)))
+        self.notify: Optional[Callable] = None
+        self.received = bytearray()
+        self.random = random.Random(self.fan.link.seed)
+
+    @classmethod
+    def register(cls, fan: SimulatedFan) -> SimulatedFan:
+        cls.fans[fan.address] = fan
+        return fan
+
+    async def connect(self) -> None:
+        if self.fan.rssi_on(self.adapter) is None:
+            raise TimeoutError(f"{self.fan.address} is out of range of {self.adapter}")
+        self.is_connected = True
+
+    async def disconnect(self) -> None:
+        self.is_connected = False
+
+    def drop_link(self) -> None:
+        """
+        Simulate the fan going away, as if it rebooted or went out of range.
+        """
+        self.is_connected = False
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    async def start_notify(self, _: str, callback: Callable) -> None:
+        self.notify = callback
+
+    async def write_gatt_char(
+        self, characteristic, data: bytes, response: bool
+    ) -> None:
+        self.received += data
+        try:
+            request = codec.loads(bytes(self.received))
+        except codec.DecodeError:
+            return
+        self.received.clear()
+        reply = codec.dumps(self.fan.handle(request))
+
+        link = self.fan.link
+        if link.drop_responses:
+            link.drop_responses -= 1
+            return
+        loop = asyncio.get_running_loop()
+        for i in range(0, len(reply), link.mtu):
+            if link.drop_rate and self.random.random() < link.drop_rate:
+                break
+            chunk = bytearray(reply[i : i + link.mtu])
+            if link.latency:
+                loop.call_later(link.latency, self.notify, characteristic, chunk)
+            else:
+                loop.call_soon(self.notify, characteristic, chunk)
+
+
+async def scan(adapter: str) -> dict[str, tuple[BLEDevice, int]]:
+    """
+    What a scan on *adapter* would find among the registered fans, in the form
+    AdapterScheduler expects.
+    """
+    return {
+        address: (fan.ble_device(), fan.rssi_on(adapter))
+        for address, fan in SimulatedClient.fans.items()
+        if fan.rssi_on(adapter) is not None
+    }
+
+
+async def connect(fan: SimulatedFan) -> Device:
+    """
+    Register *fan* and return a Device connected to it over a SimulatedClient.
+    """
+    SimulatedClient.register(fan)
+    device = Device(fan.ble_device())
+    device.client_class = SimulatedClient
+    await device.connect()
+    return device
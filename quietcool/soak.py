@@ -0,0 +1,292 @@
+"""
+Soak test: drive a long run of commands through Client, Api and Device over
+a simulated link, and fail if memory grows or latency drifts.
+
+    python -m quietcool.soak --commands 2000000 --drop-rate 0.001
+"""
+
+from dataclasses import dataclass, field
+from typing import Optional
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from .api import HumidityRange, Mode
+from .client import Client
+from .simulator import SimulatedFan, SimulatedLink, connect
+
+
+@dataclass
+class SoakConfig:
+    """
+    Attributes:
+        commands: Total commands to send
+        concurrency: Coroutines sending commands at once
+        sample_every: Commands between samples
+        warmup_samples: Samples to skip before taking the baseline
+        timeout: Seconds to wait for each response before giving up on it
+        link: The simulated link, including fragmentation and drop rate
+        max_rss_growth: Bytes of RSS growth over the baseline allowed
+        max_heap_growth: Bytes of traced Python heap growth allowed
+        max_p99_ratio: Allowed ratio of a sample's p99 latency to the baseline's
+        max_task_growth: Extra asyncio tasks allowed over the baseline
+        max_error_rate: Fraction of commands allowed to fail with an error
+                        other than a timeout
+        max_timeout_rate: Fraction of commands allowed to time out, over the
+                          whole run and in any one sample; each lost response
+                          also holds up the commands queued behind it, so
+                          this is a few times the rate responses are lost at
+    """
+
+    commands: int = 1_000_000
+    concurrency: int = 4
+    sample_every: int = 20_000
+    warmup_samples: int = 2
+    timeout: float = 0.25
+    link: SimulatedLink = field(default_factory=lambda: SimulatedLink(seed=1))
+    max_rss_growth: int = 32 * 1024 * 1024
+    max_heap_growth: int = 4 * 1024 * 1024
+    max_p99_ratio: float = 3.0
+    max_task_growth: int = 8
+    max_error_rate: float = 0.001
+    max_timeout_rate: float = 0.05
+
+
+@dataclass
+class Sample:
+    """
+    Measurements over one stretch of the run.
+
+    Attributes:
+        commands: Commands sent so far
+        elapsed: Seconds since the run started
+        rss: Resident set size, in bytes
+        heap: Python heap traced by tracemalloc, in bytes
+        tasks: Live asyncio tasks
+        timeouts: Commands that timed out in this stretch
+        errors: Commands that failed otherwise in this stretch
+        p50, p90, p99: Latency percentiles of the commands answered in this
+            stretch, in seconds; timeouts are counted separately
+    """
+
+    commands: int
+    elapsed: float
+    rss: int
+    heap: int
+    tasks: int
+    timeouts: int
+    errors: int
+    p50: float
+    p90: float
+    p99: float
+
+
+@dataclass
+class SoakResult:
+    samples: list[Sample]
+    failures: list[str]
+    top_growth: list[str]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+
+def rss() -> int:
+    """
+    Current resident set size in bytes (peak, where current isn't available).
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def _one_command(client: Client, rng: random.Random) -> None:
+    roll = rng.random()
+    if roll < 0.80:
+        await client.api.get_work_state()
+    elif roll < 0.90:
+        await client.api.get_parameters()
+    elif roll < 0.95:
+        await client.api.set_mode(rng.choice([Mode.IDLE, Mode.SMART]))
+    elif roll < 0.98:
+        await client.api.set_time(rng.randrange(12), 0, "MEDIUM")
+    else:
+        await client.api.set_temp_humidity(120, 100, 80, 90, 255, HumidityRange.LOW)
+
+
+async def soak(config: SoakConfig) -> SoakResult:
+    """
+    Run the soak test described by *config*.
+    """
+    device = await connect(SimulatedFan(link=config.link))
+    # give up on lost responses well before the harness does, so the commands
+    # queued behind one still get answered in time
+    device.response_timeout = config.timeout / 2
+    client = Client("soak", device)
+    await client.api.login()
+
+    tracemalloc.start()
+    started = time.monotonic()
+    samples: list[Sample] = []
+    latencies: list[float] = []
+    timeouts = 0
+    errors = 0
+    total_errors = 0
+    total_timeouts = 0
+    last_sampled = 0
+    sent = 0
+    done = 0
+    baseline: Optional[Sample] = None
+    baseline_snapshot = None
+    failures: list[str] = []
+
+    def take_sample() -> None:
+        nonlocal latencies, timeouts, errors, baseline, baseline_snapshot
+        nonlocal last_sampled
+        ordered = sorted(latencies)
+        sample = Sample(
+            commands=done,
+            elapsed=time.monotonic() - started,
+            rss=rss(),
+            heap=tracemalloc.get_traced_memory()[0],
+            tasks=len(asyncio.all_tasks()),
+            timeouts=timeouts,
+            errors=errors,
+            p50=percentile(ordered, 0.50),
+            p90=percentile(ordered, 0.90),
+            p99=percentile(ordered, 0.99),
+        )
+        samples.append(sample)
+        stretch, last_sampled = done - last_sampled, done
+        latencies, timeouts, errors = [], 0, 0
+        logging.getLogger(__name__).info("%s", sample)
+
+        if sample.timeouts > config.max_timeout_rate * stretch:
+            failures.append(
+                f"{sample.timeouts} of {stretch} commands timed out before "
+                f"{done} commands"
+            )
+
+        if len(samples) == config.warmup_samples + 1:
+            baseline = sample
+            baseline_snapshot = tracemalloc.take_snapshot()
+        elif baseline is not None and sample.p99 > baseline.p99 * config.max_p99_ratio:
+            failures.append(
+                f"p99 latency {sample.p99 * 1e3:.2f}ms at {done} commands is over "
+                f"{config.max_p99_ratio}x the baseline {baseline.p99 * 1e3:.2f}ms"
+            )
+
+    async def worker(seed: int) -> None:
+        nonlocal sent, done, timeouts, errors, total_errors, total_timeouts
+        rng = random.Random(seed)
+        while sent < config.commands:
+            sent += 1
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(_one_command(client, rng), config.timeout)
+            except asyncio.TimeoutError:
+                timeouts += 1
+                total_timeouts += 1
+            except Exception:
+                errors += 1
+                total_errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+            done += 1
+            if done % config.sample_every == 0:
+                take_sample()
+
+    # timeouts from dropped packets are expected; don't flood the log
+    logging.getLogger("quietcool").setLevel(logging.WARNING)
+    await asyncio.gather(*(worker(i) for i in range(config.concurrency)))
+    if done % config.sample_every:
+        take_sample()
+
+    if total_errors > config.max_error_rate * sent:
+        failures.append(f"{total_errors} of {sent} commands failed")
+    if total_timeouts > config.max_timeout_rate * sent:
+        failures.append(f"{total_timeouts} of {sent} commands timed out")
+
+    top_growth: list[str] = []
+    if baseline is not None:
+        last = samples[-1]
+        if last.rss - baseline.rss > config.max_rss_growth:
+            failures.append(f"RSS grew by {last.rss - baseline.rss} bytes")
+        if last.heap - baseline.heap > config.max_heap_growth:
+            failures.append(f"Python heap grew by {last.heap - baseline.heap} bytes")
+        if last.tasks - baseline.tasks > config.max_task_growth:
+            failures.append(f"asyncio tasks grew from {baseline.tasks} to {last.tasks}")
+        stats = tracemalloc.take_snapshot().compare_to(baseline_snapshot, "lineno")
+        top_growth = [str(stat) for stat in stats[:10]]
+    tracemalloc.stop()
+    return SoakResult(samples, failures, top_growth)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    defaults = SoakConfig()
+    parser.add_argument("--commands", type=int, default=defaults.commands)
+    parser.add_argument("--concurrency", type=int, default=defaults.concurrency)
+    parser.add_argument("--sample-every", type=int, default=defaults.sample_every)
+    parser.add_argument("--timeout", type=float, default=defaults.timeout)
+    parser.add_argument("--mtu", type=int, default=defaults.link.mtu)
+    parser.add_argument("--drop-rate", type=float, default=defaults.link.drop_rate)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=32)
+    parser.add_argument("--max-heap-growth-mb", type=float, default=4)
+    parser.add_argument("--max-p99-ratio", type=float, default=defaults.max_p99_ratio)
+    parser.add_argument("--max-error-rate", type=float, default=defaults.max_error_rate)
+    parser.add_argument(
+        "--max-timeout-rate", type=float, default=defaults.max_timeout_rate
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    config = SoakConfig(
+        commands=args.commands,
+        concurrency=args.concurrency,
+        sample_every=args.sample_every,
+        timeout=args.timeout,
+        link=SimulatedLink(mtu=args.mtu, drop_rate=args.drop_rate, seed=1),
+        max_rss_growth=int(args.max_rss_growth_mb * 1024 * 1024),
+        max_heap_growth=int(args.max_heap_growth_mb * 1024 * 1024),
+        max_p99_ratio=args.max_p99_ratio,
+        max_error_rate=args.max_error_rate,
+        max_timeout_rate=args.max_timeout_rate,
+    )
+    result = asyncio.run(soak(config))
+    for failure in result.failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    if result.failures:
+        print("Largest allocation growth since baseline:", file=sys.stderr)
+        for line in result.top_growth:
+            print(f"  {line}", file=sys.stderr)
+        return 1
+    print(f"OK: {result.samples[-1].commands} commands", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import asyncio
+import concurrent.futures
+import inspect
+import threading
+from typing import Any, Callable, Optional
+
+from .api import Api
+from .client import Client
+from .pool import ConnectionPool
+from . import logger
+
+
+class SyncClient:
+    """
+    Synchronous, thread-safe wrapper around Client.
+
+    Runs one long-lived event loop in a background thread which owns the
+    Client and its connection. Any thread can call Client and Api methods as
+    ordinary functions; the calls are queued onto the loop in the order they
+    arrive and share the single BLE link, which is reconnected on demand if
+    it drops.
+
+        with SyncClient() as fan:
+            print(fan.get_work_state())
+            fan.set_mode(Mode.IDLE)
+
+    Attributes:
+        api_id: The API ID to use, as for Client.create
+        address: Optional BLE address of the fan, as for Client.create
+        timeout: Seconds to wait for each call before raising TimeoutError
+        debounce: Debounce window for settings, as for Client.create
+        pool: This client's own ConnectionPool; Devices are bound to the loop
+            they were connected on, so they can't be shared with other loops
+    """
+
+    def __init__(
+        self,
+        api_id: Optional[str] = None,
+        address: Optional[str] = None,
+        timeout: float = 60.0,
+        debounce: float = 0.0,
+    ) -> None:
+        self.api_id = api_id
+        self.address = address
+        self.timeout = timeout
+        self.debounce = debounce
+        self.client: Optional[Client] = None
+        self.pool = ConnectionPool()
+        self.loop = asyncio.new_event_loop()
+        self._connecting: Optional[asyncio.Lock] = None
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="quietcool", daemon=True
+        )
+        self._thread.start()
+
+    async def _client(self) -> Client:
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self.client is None or not self.client.device.connected:
+                if self.client is not None:
+                    logger.info("Connection lost, reconnecting")
+                    await self.client.close()
+                self.client = await Client.create(
+                    api_id=self.api_id,
+                    address=self.address,
+                    pool=self.pool,
+                    debounce=self.debounce,
+                )
+            return self.client
+
+    def run(self, fn: Callable[[Client], Any]) -> Any:
+        """
+        Run fn(client) on the background loop and return its result.
+        *fn* should return an awaitable, e.g.
+        `fan.run(lambda client: client.api.get_version())`.
+        """
+        if self.loop.is_closed():
+            raise RuntimeError("SyncClient is closed")
+
+        async def call() -> Any:
+            return await fn(await self._client())
+
+        return self._wait(asyncio.run_coroutine_threadsafe(call(), self.loop))
+
+    def _wait(self, future: concurrent.futures.Future) -> Any:
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # don't leave the call running, or queued, on the loop
+            future.cancel()
+            raise
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        for cls, target in ((Client, lambda c: c), (Api, lambda c: c.api)):
+            if inspect.iscoroutinefunction(getattr(cls, name, None)):
+
+                def method(*args, **kwargs) -> Any:
+                    return self.run(lambda c: getattr(target(c), name)(*args, **kwargs))
+
+                method.__name__ = name
+                method.__doc__ = getattr(cls, name).__doc__
+                return method
+        raise AttributeError(name)
+
+    def close(self) -> None:
+        """
+        Close the client and its connection, and stop the background loop.
+        Connections held by other clients are left alone.
+        """
+        if self.loop.is_closed():
+            return
+
+        async def shutdown() -> None:
+            if self.client is not None:
+                await self.client.close()
+            await self.pool.close()
+
+        try:
+            self._wait(asyncio.run_coroutine_threadsafe(shutdown(), self.loop))
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+
+    def __enter__(self) -> "SyncClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,199 @@
+from typing import AsyncIterator, Optional
+import asyncio
+import math
+import time
+
+from .api import Api, Mode, RemainTime, WorkState
+from .poller import Poller
+from . import logger
+
+
+def total_seconds(remain: RemainTime) -> int:
+    return remain.hours * 3600 + remain.minutes * 60 + remain.seconds
+
+
+class TimerTracker:
+    """
+    Follows the fan's Timer mode countdown without polling get_remain_time.
+
+    The remaining time is read once when Timer mode is entered, whether through
+    Api.set_mode or seen as a change in WorkState.mode from the poller, and is
+    counted down locally from then on. It's read again every *resync_interval*
+    seconds, sooner after a read shows the local count had drifted by more
+    than *tolerance* seconds, and whenever the local count runs out while the
+    fan is still in Timer mode.
+
+    Attributes:
+        api: The Api to read the remaining time from
+        poller: The Poller whose readings show mode changes
+        resync_interval: Longest time between reads of the remaining time
+        min_resync_interval: Shortest time between reads, however much drift
+        tolerance: Seconds of drift tolerated before resyncing more often
+        deadline: Monotonic time the timer runs out, or None if it isn't running
+        synced_at: Monotonic time of the last read
+        drift: Seconds the local count was out by at the last read
+    """
+
+    def __init__(
+        self,
+        api: Api,
+        poller: Optional[Poller] = None,
+        resync_interval: float = 600.0,
+        min_resync_interval: float = 30.0,
+        tolerance: float = 2.0,
+    ) -> None:
+        self.api = api
+        self.owns_poller = poller is None
+        self.poller = poller if poller is not None else Poller(api)
+        self.resync_interval = resync_interval
+        self.min_resync_interval = min_resync_interval
+        self.tolerance = tolerance
+        self.deadline: Optional[float] = None
+        self.synced_at: Optional[float] = None
+        self.drift = 0.0
+        self._interval = resync_interval
+        self._mode: Optional[str] = None
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._listen()
+
+    def _listen(self) -> None:
+        if self.on_state not in self.poller.listeners:
+            self.poller.subscribe(self.on_state)
+        if self.on_mode not in self.api.mode_listeners:
+            self.api.mode_listeners.append(self.on_mode)
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left on the timer by the local count, or None if it isn't
+        running.
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def _notify(self) -> None:
+        # wake everything waiting on the current event, and start a new one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def on_mode(self, mode: Mode) -> None:
+        await self.mode_changed(mode.value)
+
+    async def on_state(self, state: WorkState) -> None:
+        await self.mode_changed(state.mode)
+
+    async def mode_changed(self, mode: str) -> None:
+        previous, self._mode = self._mode, mode
+        if mode != Mode.TIMER.value:
+            if self.deadline is not None:
+                logger.debug("Timer stopped")
+                self.deadline = None
+                self._notify()
+        elif previous != mode or self.deadline is None:
+            self._interval = self.resync_interval
+            await self.sync()
+
+    async def sync(self) -> float:
+        """
+        Read the remaining time from the fan and restart the local count from
+        it.
+
+        Returns:
+            Seconds remaining
+        """
+        remain = total_seconds(await self.api.get_remain_time())
+        now = time.monotonic()
+        if self.deadline is not None:
+            self.drift = self.deadline - now - remain
+            if abs(self.drift) > self.tolerance:
+                logger.debug("Timer drifted by %.1fs", self.drift)
+                self._interval = max(self.min_resync_interval, self._interval / 2)
+            else:
+                self._interval = min(self.resync_interval, self._interval * 2)
+        self.deadline = now + remain
+        self.synced_at = now
+        self._notify()
+        return remain
+
+    async def run(self) -> None:
+        """
+        Resync the running timer when it's due, forever. Errors reading the fan
+        are logged and retried at the next due time.
+        """
+        while True:
+            changed = self._changed
+            remaining = self.remaining()
+            if remaining is None:
+                await changed.wait()
+                continue
+            if remaining > 0:
+                due = min(self.synced_at + self._interval, self.deadline)
+            else:
+                # ran out locally but the fan hasn't been seen leaving Timer mode
+                due = self.synced_at + self.min_resync_interval
+            try:
+                await asyncio.wait_for(changed.wait(), max(0.0, due - time.monotonic()))
+                continue
+            except TimeoutError:
+                pass
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Reading the remaining time failed: %s", e)
+                self.synced_at = time.monotonic()
+
+    async def countdown(self) -> AsyncIterator[Optional[int]]:
+        """
+        Yields the whole seconds left on the timer each time the count changes,
+        or None while the fan isn't in Timer mode.
+        """
+        last: object = object()
+        while True:
+            changed = self._changed
+            remaining = self.remaining()
+            value = None if remaining is None else math.ceil(remaining)
+            if value != last:
+                yield value
+                last = value
+            timeout = None
+            if remaining:
+                # until the count next crosses a whole second
+                timeout = remaining - math.floor(remaining) or 1.0
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+            except TimeoutError:
+                pass
+
+    def start(self) -> asyncio.Task:
+        """
+        Start resyncing in the background, and the poller if the tracker made
+        its own.
+        """
+        self._listen()
+        if self.owns_poller:
+            self.poller.start()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        """
+        Stop resyncing, and stop following the Api and Poller until started
+        again.
+        """
+        if self.on_state in self.poller.listeners:
+            self.poller.unsubscribe(self.on_state)
+        if self.on_mode in self.api.mode_listeners:
+            self.api.mode_listeners.remove(self.on_mode)
+        if self.owns_poller:
+            await self.poller.stop()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
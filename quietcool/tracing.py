@@ -0,0 +1,205 @@
+import abc
+import functools
+import itertools
+import json
+import time
+from collections import deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Optional, TextIO
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+
+@dataclass
+class Span:
+    """
+    A timed operation. Spans started while another is current become its
+    children, across awaits, via a context variable.
+
+    Attributes:
+        name: What was being done, e.g. "api.get_work_state"
+        trace_id: span_id of the root span of this trace
+        span_id: Unique id of this span within the process
+        parent_id: span_id of the parent span, if any
+        start: Wall clock start time, in seconds since the epoch
+        duration: Seconds taken, once the span has ended
+        attributes: Extra details about the operation
+        error: The exception that ended the span, if any
+    """
+
+    name: str
+    trace_id: int
+    span_id: int
+    parent_id: Optional[int]
+    start: float
+    duration: Optional[float] = None
+    attributes: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class Exporter(abc.ABC):
+    """
+    Receives spans from a Tracer. Subclasses implement export, and override
+    start if they need to know about spans before they finish.
+    """
+
+    def start(self, span: Span) -> None:
+        pass
+
+    @abc.abstractmethod
+    def export(self, span: Span) -> None:
+        """Handle a finished span."""
+
+
+class RingBufferExporter(Exporter):
+    """
+    Keeps the most recent *maxlen* finished spans in memory.
+    """
+
+    def __init__(self, maxlen: int = 1000) -> None:
+        self.spans: deque[Span] = deque(maxlen=maxlen)
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+
+class JsonFileExporter(Exporter):
+    """
+    Appends each finished span to a file as a line of JSON.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.file: TextIO = open(path, "a", encoding="utf-8")
+
+    def export(self, span: Span) -> None:
+        self.file.write(json.dumps(asdict(span), default=str) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class OpenTelemetryExporter(Exporter):
+    """
+    Mirrors spans into OpenTelemetry. Requires the opentelemetry-api package,
+    and an SDK configured by the application to actually ship them anywhere.
+    """
+
+    def __init__(self, tracer_provider: Any = None) -> None:
+        if otel_trace is None:
+            raise ImportError(
+                "OpenTelemetryExporter requires the opentelemetry-api package"
+            )
+        self.tracer = otel_trace.get_tracer(
+            "quietcool", tracer_provider=tracer_provider
+        )
+        self.open: dict[int, Any] = {}
+
+    def start(self, span: Span) -> None:
+        parent = self.open.get(span.parent_id)
+        context = otel_trace.set_span_in_context(parent) if parent else None
+        self.open[span.span_id] = self.tracer.start_span(
+            span.name, context=context, start_time=int(span.start * 1e9)
+        )
+
+    def export(self, span: Span) -> None:
+        otel_span = self.open.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        for key, value in span.attributes.items():
+            otel_span.set_attribute(key, value)
+        if span.error is not None:
+            otel_span.set_status(
+                otel_trace.Status(otel_trace.StatusCode.ERROR, span.error)
+            )
+        otel_span.end(end_time=int((span.start + span.duration) * 1e9))
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("quietcool_span", default=None)
+_ids = itertools.count(1)
+
+
+class _SpanContext:
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        parent = _current.get()
+        span_id = next(_ids)
+        self.span = Span(
+            self.name,
+            trace_id=parent.trace_id if parent else span_id,
+            span_id=span_id,
+            parent_id=parent.span_id if parent else None,
+            start=time.time(),
+            attributes=self.attributes,
+        )
+        self.started = time.perf_counter()
+        self.token = _current.set(self.span)
+        for exporter in self.tracer.exporters:
+            exporter.start(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.span.duration = time.perf_counter() - self.started
+        if exc is not None:
+            self.span.error = repr(exc)
+        _current.reset(self.token)
+        for exporter in self.tracer.exporters:
+            exporter.export(self.span)
+
+
+class Tracer:
+    """
+    A minimal tracer. With no exporters added it does nothing, so the
+    instrumentation costs next to nothing unless someone is looking.
+    """
+
+    def __init__(self) -> None:
+        self.exporters: list[Exporter] = []
+
+    def add_exporter(self, exporter: Exporter) -> None:
+        self.exporters.append(exporter)
+
+    def remove_exporter(self, exporter: Exporter) -> None:
+        self.exporters.remove(exporter)
+
+    def span(self, name: str, **attributes: Any):
+        """
+        Context manager timing a span called *name*, e.g.
+
+            with tracer.span("device.write", length=len(data)):
+                ...
+        """
+        if not self.exporters:
+            return nullcontext()
+        return _SpanContext(self, name, attributes)
+
+
+tracer = Tracer()
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator wrapping a coroutine function in a span called *name*.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -25,8 +25,12 @@ setup(
     ],
     python_requires=">=3.10",
     install_requires=[
-        "bleak>=0.21.1",
+        "bleak>=1.0",
     ],
+    extras_require={
+        "fast": ["orjson>=3.9"],
+        "mqtt": ["aiomqtt>=2.0"],
+    },
     entry_points={
         "console_scripts": [
             "quietcool=quietcool:main",
@@ -0,0 +1,111 @@
+import asyncio
+
+from quietcool import simulator
+from quietcool.adapters import AdapterScheduler
+from quietcool.api import Api
+from quietcool.pool import ConnectionPool
+from quietcool.simulator import SimulatedClient, SimulatedFan
+
+
+def fans(*adapters: dict[str, int]) -> list[SimulatedFan]:
+    SimulatedClient.fans.clear()
+    return [
+        SimulatedClient.register(
+            SimulatedFan(address=f"SIM:00:00:00:00:{i:02X}", adapters=rssi)
+        )
+        for i, rssi in enumerate(adapters, 1)
+    ]
+
+
+def scheduler() -> AdapterScheduler:
+    return AdapterScheduler(
+        ["hci0", "hci1"], scan=simulator.scan, client_class=SimulatedClient
+    )
+
+
+def test_connections_spread_across_adapters():
+    fans(*[{"hci0": -50, "hci1": -55}] * 4)
+
+    async def run():
+        adapters = scheduler()
+        devices = await adapters.connect_all()
+        return adapters, devices
+
+    adapters, devices = asyncio.run(run())
+    assert len(devices) == 4
+    assert len(adapters.adapters["hci0"].links) == 2
+    assert len(adapters.adapters["hci1"].links) == 2
+
+
+def test_failed_connect_moves_to_next_adapter():
+    (fan,) = fans({"hci0": -40, "hci1": -70})
+
+    async def run():
+        adapters = scheduler()
+        await adapters.survey()
+        # hci0 heard it in the survey but has lost it since
+        fan.adapters = {"hci1": -70}
+        return adapters, await adapters.connect(fan.address)
+
+    adapters, device = asyncio.run(run())
+    assert device.connected
+    assert device.adapter == "hci1"
+    assert adapters.adapters["hci0"].failures == 1
+
+
+def test_dropped_link_is_moved_and_logs_in_again():
+    (fan,) = fans({"hci0": -40, "hci1": -70})
+
+    async def run():
+        adapters = scheduler()
+        device = await adapters.connect(fan.address)
+        api = Api(device, "test")
+        await api.ensure_logged_in()
+        assert device.adapter == "hci0"
+
+        fan.adapters = {"hci1": -70}
+        device.client.drop_link()
+        assert not api.logged_in
+        assert await adapters.maintain() == []
+        await api.get_work_state()
+        return adapters, device, api
+
+    adapters, device, api = asyncio.run(run())
+    assert adapters.devices[fan.address] is device
+    assert device.connected
+    assert device.adapter == "hci1"
+    assert api.logged_in
+    assert not adapters.adapters["hci0"].links
+
+
+def test_unreachable_fan_is_forgotten():
+    (fan,) = fans({"hci0": -40})
+
+    async def run():
+        adapters = scheduler()
+        device = await adapters.connect(fan.address)
+        fan.adapters = {}
+        device.client.drop_link()
+        return adapters, await adapters.maintain()
+
+    adapters, failed = asyncio.run(run())
+    assert failed == [fan.address]
+    assert fan.address not in adapters.devices
+    assert not adapters.adapters["hci0"].links
+
+
+def test_pool_waits_for_dropped_link_to_move():
+    (fan,) = fans({"hci0": -40, "hci1": -70})
+
+    async def run():
+        pool = ConnectionPool(adapters=scheduler())
+        device = await pool.acquire(fan.address)
+        fan.adapters = {"hci1": -70}
+        device.client.drop_link()
+        again = await pool.acquire(fan.address)
+        await pool.close()
+        return device, again
+
+    device, again = asyncio.run(run())
+    assert again is device
+    assert device.adapter == "hci1"
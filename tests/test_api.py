@@ -0,0 +1,69 @@
+import asyncio
+
+from quietcool.api import Api, Mode
+from quietcool.simulator import SimulatedFan, connect
+
+
+def test_lost_read_does_not_block_later_reads():
+    async def run():
+        fan = SimulatedFan()
+        device = await connect(fan)
+        device.response_timeout = 0.2
+        api = Api(device, "test")
+        await api.ensure_logged_in()
+        fan.link.drop_responses = 1
+
+        async def read():
+            try:
+                await asyncio.wait_for(api.get_work_state(), 0.25)
+                return True
+            except TimeoutError:
+                return False
+
+        results = []
+        for _ in range(20):
+            results.append(asyncio.create_task(read()))
+            await asyncio.sleep(0.1)
+        return await asyncio.gather(*results), fan
+
+    results, fan = asyncio.run(run())
+    # readers that joined the lost read time out with it, later ones get
+    # answers
+    assert not results[0]
+    assert all(results[-10:])
+    assert fan.commands > 2
+
+
+def test_set_mode_does_not_wait_for_mode_listeners():
+    async def run():
+        api = Api(await connect(SimulatedFan()), "test")
+        heard = []
+        release = asyncio.Event()
+
+        async def listener(mode):
+            await release.wait()
+            heard.append(mode)
+
+        api.mode_listeners.append(listener)
+        await asyncio.wait_for(api.set_mode(Mode.SMART), 1)
+        assert heard == []
+        release.set()
+        await asyncio.sleep(0)
+        return heard
+
+    assert asyncio.run(run()) == [Mode.SMART]
+
+
+def test_slow_read_is_joined_until_it_completes():
+    async def run():
+        fan = SimulatedFan()
+        api = Api(await connect(fan), "test")
+        await api.ensure_logged_in()
+        fan.link.latency = 0.8
+        before = fan.commands
+        first = asyncio.create_task(api.get_work_state())
+        await asyncio.sleep(0.6)
+        await asyncio.gather(first, api.get_work_state())
+        return fan.commands - before
+
+    assert asyncio.run(run()) == 1
@@ -0,0 +1,37 @@
+import asyncio
+from dataclasses import dataclass
+
+from quietcool.api import Api, Mode
+from quietcool.automation import AutomationEngine, Rule
+from quietcool.simulator import SimulatedFan, connect
+
+
+@dataclass
+class StubbornFan(SimulatedFan):
+    refuse: bool = True
+
+    def handle(self, request: dict) -> dict:
+        if request["Api"] == "SetMode" and self.refuse:
+            self.commands += 1
+            return {"Api": "SetMode", "WorkMode": self.state["Mode"], "Flag": "FALSE"}
+        return super().handle(request)
+
+
+def test_refused_mode_change_stays_pending():
+    async def run():
+        fan = StubbornFan()
+        api = Api(await connect(fan), "test")
+        rule = Rule("hot", "temperature", on_at=70, off_at=65, min_dwell=0)
+        engine = AutomationEngine(api, [rule])
+
+        await engine.poller.poll()
+        refused = (engine.pending, engine.last_action, fan.state["Mode"])
+        fan.refuse = False
+        await engine.poller.poll()
+        return refused, (engine.pending, engine.last_action, fan.state["Mode"])
+
+    refused, accepted = asyncio.run(run())
+    assert refused == (Mode.SMART, None, "Idle")
+    assert accepted[0] is None
+    assert accepted[1] is not None
+    assert accepted[2] == Mode.SMART.value
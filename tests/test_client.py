@@ -0,0 +1,19 @@
+import asyncio
+
+from quietcool.client import Client
+from quietcool.simulator import SimulatedFan, connect
+
+
+def test_create_debounces_settings():
+    async def run():
+        fan = SimulatedFan()
+        device = await connect(fan)
+        async with Client.create("test", device=device, debounce=0.05) as client:
+            await client.api.ensure_logged_in()
+            before = fan.commands
+            await asyncio.gather(
+                *(client.api.set_time(hour, 0, "MEDIUM") for hour in range(1, 6))
+            )
+            return fan.commands - before, fan.state["SetHour"]
+
+    assert asyncio.run(run()) == (1, 5)
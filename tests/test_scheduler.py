@@ -0,0 +1,80 @@
+import asyncio
+
+from quietcool.debounce import Debouncer
+from quietcool.scheduler import Priority, Scheduler
+
+
+def test_most_urgent_class_runs_first():
+    async def run():
+        scheduler = Scheduler()
+        ran = []
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def blocker():
+            started.set()
+            await release.wait()
+
+        def job(name):
+            async def fn():
+                ran.append(name)
+
+            return fn
+
+        first = asyncio.create_task(scheduler.submit(blocker))
+        await started.wait()
+        jobs = [
+            asyncio.create_task(scheduler.submit(job("read"), Priority.TELEMETRY)),
+            asyncio.create_task(scheduler.submit(job("set"), Priority.CONFIGURATION)),
+            asyncio.create_task(scheduler.submit(job("tap"), Priority.INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, *jobs)
+        return ran
+
+    assert asyncio.run(run()) == ["tap", "set", "read"]
+
+
+def test_identical_reads_are_coalesced():
+    async def run():
+        scheduler = Scheduler()
+        calls = 0
+
+        async def read():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(
+            *(scheduler.submit(read, Priority.TELEMETRY, "state") for _ in range(5))
+        )
+        return results, calls, scheduler.metrics[Priority.TELEMETRY].coalesced
+
+    results, calls, coalesced = asyncio.run(run())
+    assert calls == 1
+    assert coalesced == 4
+    assert results == [1] * 5
+
+
+def test_debouncer_sends_only_the_last_write():
+    async def run():
+        debouncer = Debouncer(window=0.05)
+        sent = []
+
+        def write(value):
+            async def fn():
+                sent.append(value)
+                return value
+
+            return fn
+
+        results = await asyncio.gather(
+            *(debouncer.submit("temp", write(value)) for value in range(5))
+        )
+        return results, sent
+
+    results, sent = asyncio.run(run())
+    assert sent == [4]
+    assert results == [4] * 5
@@ -0,0 +1,18 @@
+import asyncio
+
+from quietcool.api import Api
+from quietcool.simulator import SimulatedFan, connect
+from quietcool.timer import TimerTracker
+
+
+def test_stopped_tracker_stops_listening():
+    async def run():
+        api = Api(await connect(SimulatedFan()), "test")
+        tracker = TimerTracker(api)
+        tracker.start()
+        await tracker.stop()
+        return api, tracker
+
+    api, tracker = asyncio.run(run())
+    assert api.mode_listeners == []
+    assert tracker.poller.listeners == []